@@ -1,81 +1,1098 @@
 """
 ASR.py - Módulo de Reconocimiento Automático de Voz (ASR)
 
-Este módulo implementa el reconocimiento de voz en español utilizando 
+Este módulo implementa el reconocimiento de voz en español utilizando
 Whisper a través de la librería `faster_whisper`.
 
+Importar el módulo no abre el micrófono ni carga ningún modelo: el modelo
+Whisper se gestiona con `ASREngine`, que lo carga en el primer uso y ejecuta
+una decodificación de calentamiento, y el micrófono se abre al escuchar.
+
 Funcionalidad:
 - Captura de audio desde el micrófono.
-- Almacenamiento temporal del audio grabado.
+- Conversión del audio capturado a un buffer en memoria (float32, 16 kHz).
 - Transcripción de voz a texto usando Whisper.
-- Retorno del texto transcrito junto con la ubicación del archivo de audio.
+- Retorno del texto transcrito junto con el audio en memoria.
+- Modo streaming: transcripciones parciales mientras el usuario habla y
+  transcripción final en cuanto se detecta el fin de la frase.
+
+El audio solo se escribe en disco si la depuración está activada
+(variable de entorno `PATO_DEBUG_AUDIO=1`).
 
 Dependencias:
 - `speech_recognition` para la captura de audio.
 - `faster_whisper` para la transcripción eficiente.
+- `numpy` para manejar el audio en memoria.
 - `torch` para detección de hardware y uso de CUDA si está disponible.
+- `psutil` para medir la memoria ocupada por cada modelo.
+- `IntentClassifier.normalizar` para comparar frases sin tildes ni puntuación.
+
+Clases:
+- `ASREngine`: Modelo Whisper configurable (tamaño, dispositivo, compute_type, hilos).
+- `NoiseFloorTracker`: Estimador en segundo plano del ruido ambiente que mantiene
+  actualizado `recognizer.energy_threshold` para empezar a escuchar sin esperas.
+- `ModelTiers`: Modelos residentes por nivel (reposo/activo) bajo un presupuesto de memoria.
+- `WakeWordSpotter`: Detector ligero de la frase de activación para el estado inactivo.
+- `ConfidenceGate`: Filtro que descarta transcripciones de ruido o alucinaciones de Whisper
+  antes de que lleguen al gestor de diálogo.
+- `Endpointer`: Decide cuánto silencio esperar al final de la frase según lo transcrito.
 
 Métodos:
+- `configurar_motor(**opciones)`: Sustituye el motor ASR por defecto.
+- `iniciar_seguimiento_ruido()`: Arranca el estimador de ruido ambiente.
 - `listen_for_command()`: Captura un comando por voz y lo transcribe.
+- `escuchar_en_streaming(on_parcial)`: Captura un comando emitiendo hipótesis parciales y final.
+- `transcribir_frase(audio)`: Transcribe una frase ya capturada (p. ej. por `AudioCapture`).
+- `transcribir_segun_estado(audio, solo_activacion)`: Elige el nivel de modelo según la conversación.
+- `normalizar_activacion(texto)`: Lleva las variantes de "oye pato" y "apagar pato" a su forma canónica.
+- `transcribe_audio_file(audio_path)`: Transcribe un archivo de audio.
+- `transcribe_audio_files(paths, batch_size, workers)`: Transcribe varios archivos en lote.
 """
 
 import speech_recognition as sr
 import os
-from faster_whisper import WhisperModel
-import torch
+import time
+import collections
+import contextlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from psutil import Process
+from IntentClassifier import normalizar
 
-# Determinar si se usará GPU o CPU
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# Frecuencia de muestreo esperada por Whisper y por el modelo SER
+SAMPLE_RATE = 16000
 
-# Inicialización del micrófono y el reconocedor de voz
-source = sr.Microphone()
+# Si está activo, cada comando se guarda también en `Resources/` para depuración
+DEBUG_AUDIO = os.environ.get("PATO_DEBUG_AUDIO", "0") == "1"
+
+# Reconocedor de voz; el micrófono se abre la primera vez que se usa y se mantiene abierto
+source = None
 recognizer = sr.Recognizer()
 
-# Selección del modelo Whisper (opciones: tiny, base, small)
-selected_model = 'small'
-whisper_model = WhisperModel(selected_model, device=device, compute_type="float32")
+# Acceso exclusivo al micrófono compartido entre la escucha y el estimador de ruido
+_mic_lock = threading.Lock()
+_mic_solicitado = threading.Event()
+
+
+class ASREngine:
+    """
+    Motor de transcripción Whisper con carga diferida.
+
+    El modelo no se carga al crear el objeto sino en el primer uso (o al llamar
+    a `cargar()`), y tras cargarlo se decodifica un segundo de silencio para que
+    el primer comando real no pague la reserva de memoria ni la inicialización.
+    """
+
+    COMPUTE_TYPES = ("int8", "int8_float32", "float32")
+
+    def __init__(self, model_size="small", device=None, compute_type="float32",
+                 cpu_threads=0, num_workers=1, language="es", warmup=True):
+        """
+        Guarda la configuración del modelo sin cargarlo.
+
+        Parámetros:
+        - model_size (str): Tamaño del modelo Whisper (tiny, base, small...).
+        - device (str, opcional): "cuda" o "cpu"; si es None se detecta automáticamente.
+        - compute_type (str): Precisión de inferencia: int8, int8_float32 o float32.
+        - cpu_threads (int): Hilos de CPU por worker (0 usa el valor por defecto de CTranslate2).
+        - num_workers (int): Llamadas a `transcribe()` que pueden ejecutarse en paralelo.
+        - language (str): Idioma de transcripción.
+        - warmup (bool): Si se ejecuta una decodificación de calentamiento tras cargar.
+        """
+        if compute_type not in self.COMPUTE_TYPES:
+            raise ValueError(f"compute_type debe ser uno de {self.COMPUTE_TYPES}, no '{compute_type}'")
+
+        self.model_size = model_size
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.language = language
+        self.warmup = warmup
+        self._model = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def detectar_dispositivo():
+        """Devuelve "cuda" si hay una GPU disponible y "cpu" en caso contrario."""
+        import torch  # Importación diferida: torch es costoso de importar
+        return "cuda" if torch.cuda.is_available() else "cpu"
+
+    @property
+    def cargado(self):
+        """Indica si el modelo ya está en memoria."""
+        return self._model is not None
+
+    @property
+    def model(self):
+        """Modelo Whisper, cargado en el primer acceso."""
+        if self._model is None:
+            self.cargar()
+        return self._model
+
+    def cargar(self):
+        """Carga el modelo (si no lo está ya) y ejecuta el calentamiento."""
+        with self._lock:
+            if self._model is not None:
+                return
+
+            self.device = self.device or self.detectar_dispositivo()
+            inicio = time.perf_counter()
+            model = WhisperModel(
+                self.model_size, device=self.device, compute_type=self.compute_type,
+                cpu_threads=self.cpu_threads, num_workers=self.num_workers
+            )
+            print(f"ASR -> Modelo Whisper '{self.model_size}' ({self.device}, {self.compute_type}) "
+                  f"cargado en {time.perf_counter() - inicio:.2f} s")
+
+            if self.warmup:
+                inicio = time.perf_counter()
+                segments, _ = model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), language=self.language)
+                list(segments)  # Los segmentos se decodifican al recorrerlos
+                print(f"ASR -> Calentamiento completado en {time.perf_counter() - inicio:.2f} s")
+
+            self._model = model
+
+    def transcribir(self, audio, **opciones):
+        """
+        Transcribe audio con Whisper.
+
+        Parámetros:
+        - audio (str | np.ndarray): Ruta de un archivo o buffer float32 a 16 kHz.
+        - opciones: Parámetros adicionales para `WhisperModel.transcribe`.
+
+        Retorna:
+        - (str): Texto transcrito.
+        """
+        return self.transcribir_con_confianza(audio, **opciones)[0]
+
+    def transcribir_con_confianza(self, audio, **opciones):
+        """
+        Transcribe audio y devuelve también las métricas de confianza de Whisper.
+
+        Retorna:
+        - (str, dict): Texto transcrito y `{"avg_logprob", "no_speech_prob", "compression_ratio"}`.
+        """
+        segments, _ = self.model.transcribe(audio, language=self.language, **opciones)
+        segments = list(segments)
+        return "".join(segment.text for segment in segments), self.confianza(segments)
+
+    @staticmethod
+    def confianza(segments):
+        """
+        Resume la confianza de una transcripción a partir de sus segmentos.
+
+        `avg_logprob` y `no_speech_prob` se promedian ponderando por la duración
+        de cada segmento; `compression_ratio` toma el peor (mayor) valor.
+        """
+        if not segments:
+            return {"avg_logprob": None, "no_speech_prob": None, "compression_ratio": None}
+
+        pesos = [max(segment.end - segment.start, 1e-3) for segment in segments]
+        return {
+            "avg_logprob": float(np.average([segment.avg_logprob for segment in segments], weights=pesos)),
+            "no_speech_prob": float(np.average([segment.no_speech_prob for segment in segments], weights=pesos)),
+            "compression_ratio": float(max(segment.compression_ratio for segment in segments)),
+        }
+
+
+# Motor por defecto (opciones de modelo: tiny, base, small)
+engine = ASREngine(model_size="small", compute_type="float32")
+
+
+def configurar_motor(**opciones):
+    """
+    Sustituye el motor ASR por defecto por uno con la configuración indicada.
+
+    Ejemplo: `ASR.configurar_motor(compute_type="int8", cpu_threads=4)`.
 
-def listen_for_command():
+    Si el nuevo motor no cabe en el presupuesto de `model_tiers` se lanza
+    `ValueError` y se conserva el motor anterior.
     """
-    Escucha un comando a través del micrófono, graba el audio en un archivo temporal 
-    y lo transcribe utilizando Whisper.
+    global engine
+    nuevo = ASREngine(**opciones)
+    model_tiers.asignar(TIER_ACTIVO, nuevo)
+    engine = nuevo
+    _modelos_lote.clear()
+    return engine
+
+
+# Niveles de modelo según el estado de la conversación
+TIER_REPOSO = "reposo"  # Conversación inactiva: activación y apagado
+TIER_ACTIVO = "activo"  # Conversación activa: comandos y tareas
+
+
+class ModelTiers:
+    """
+    Conjunto de motores Whisper residentes, uno por nivel de conversación.
+
+    Con la conversación inactiva basta un modelo pequeño para reconocer la frase
+    de activación o de apagado; durante la conversación se usa el modelo
+    configurado. Ambos se mantienen cargados para no pagar la carga en cada
+    cambio de estado, siempre que quepan en el presupuesto de memoria.
+    """
+
+    # Millones de parámetros de cada tamaño de Whisper
+    PARAMETROS_M = {"tiny": 39, "base": 74, "small": 244, "medium": 769, "large-v2": 1550, "large-v3": 1550}
+    BYTES_POR_PARAMETRO = {"int8": 1, "int8_float32": 1, "float32": 4}
+
+    def __init__(self, engines, presupuesto_mb=2048):
+        """
+        Asigna los motores de cada nivel sin cargarlos.
+
+        Parámetros:
+        - engines (dict[str, ASREngine]): Motor asignado a cada nivel.
+        - presupuesto_mb (float | None): Memoria máxima estimada para todos los modelos.
+        """
+        self.presupuesto_mb = presupuesto_mb
+        self.engines = {}
+        self.usos = collections.Counter()  # Frases transcritas por nivel
+        self.memoria_medida_mb = {}  # Incremento de RSS observado al cargar cada nivel
+        for tier, tier_engine in engines.items():
+            self.asignar(tier, tier_engine)
+
+    @classmethod
+    def memoria_estimada_mb(cls, tier_engine):
+        """Estima la memoria que ocupa un motor a partir de su tamaño y precisión."""
+        parametros = cls.PARAMETROS_M.get(tier_engine.model_size, cls.PARAMETROS_M["large-v3"])
+        return parametros * cls.BYTES_POR_PARAMETRO[tier_engine.compute_type] * 1.2  # +20 % de buffers
+
+    def asignar(self, tier, tier_engine):
+        """Asigna un motor a un nivel comprobando que el conjunto cabe en el presupuesto."""
+        engines = {**self.engines, tier: tier_engine}
+        total = sum(self.memoria_estimada_mb(e) for e in {id(e): e for e in engines.values()}.values())
+        if self.presupuesto_mb is not None and total > self.presupuesto_mb:
+            raise ValueError(
+                f"Los modelos ASR ({total:.0f} MB estimados) superan el presupuesto de {self.presupuesto_mb} MB"
+            )
+        self.engines = engines
+
+    def engine(self, tier):
+        """Devuelve el motor asignado a un nivel."""
+        return self.engines[tier]
+
+    def cargar(self):
+        """Carga todos los niveles y registra la memoria que ocupa cada uno."""
+        proceso = Process()
+        for tier, tier_engine in self.engines.items():
+            if tier_engine.cargado:
+                continue
+            rss_inicial = proceso.memory_info().rss
+            tier_engine.cargar()
+            self.memoria_medida_mb[tier] = (proceso.memory_info().rss - rss_inicial) / 2**20
+
+    def info(self, tier):
+        """Describe el nivel usado para una transcripción."""
+        return {"tier": tier, "modelo": self.engines[tier].model_size}
+
+    def transcribir(self, audio_array, tier, **opciones):
+        """
+        Transcribe con el motor de un nivel.
+
+        Retorna:
+        - (str, dict): Texto transcrito y descripción del nivel usado junto con
+          las métricas de confianza de la transcripción.
+        """
+        self.usos[tier] += 1
+        texto, confianza = self.engines[tier].transcribir_con_confianza(audio_array, **opciones)
+        return texto, {**self.info(tier), **confianza}
+
+    def estado(self):
+        """Devuelve la configuración, el uso y la memoria de cada nivel para diagnóstico."""
+        return {
+            tier: {
+                "modelo": tier_engine.model_size,
+                "compute_type": tier_engine.compute_type,
+                "cargado": tier_engine.cargado,
+                "memoria_estimada_mb": round(self.memoria_estimada_mb(tier_engine)),
+                "memoria_medida_mb": self.memoria_medida_mb.get(tier),
+                "usos": self.usos[tier],
+            }
+            for tier, tier_engine in self.engines.items()
+        }
+
+
+model_tiers = ModelTiers({
+    TIER_REPOSO: ASREngine(model_size="tiny", compute_type="int8"),
+    TIER_ACTIVO: engine,
+})
+
+
+# Frases que interesan con la conversación inactiva: activación ("oye pato") y
+# apagado ("apagar pato"), con las variantes habituales de un modelo pequeño
+PATRON_ACTIVACION = re.compile(
+    r'\b(?P<activacion>(?:oye|olle|oie|hoye|oi)\W*\s*(?:pato|bato|plato))\b'
+    r'|\b(?P<apagado>apaga(?:r)?\W*\s*(?:pato|bato|plato))\b',
+    re.IGNORECASE
+)
+
+# Forma canónica de cada frase, la que reconoce `DialogManager`
+FRASES_CANONICAS = {"activacion": "oye pato", "apagado": "apagar pato"}
+
+
+def normalizar_activacion(texto):
+    """
+    Sustituye la variante de activación o apagado reconocida por su forma canónica.
+
+    El detector acepta variantes como "olle pato" u "oye bato"; sin esta
+    normalización el gestor de diálogo, que solo reconoce la forma canónica,
+    descartaría la frase.
+    """
+    return PATRON_ACTIVACION.sub(lambda m: FRASES_CANONICAS[m.lastgroup], texto, count=1)
+
+
+class WakeWordSpotter:
+    """
+    Detector ligero de la frase de activación.
+
+    Con la conversación inactiva solo interesa saber si la frase empieza con
+    "oye pato" (o "apagar pato"). En lugar de transcribir todo con el modelo
+    principal, se decodifican solo los primeros segundos con el modelo del nivel
+    de reposo (`tiny` en int8) y búsqueda voraz; la transcripción completa solo
+    se ejecuta si el patrón aparece.
+    """
+
+    def __init__(self, engine=None, ventana=3.0, patron=PATRON_ACTIVACION):
+        """
+        Configura el detector sin cargar el modelo.
+
+        Parámetros:
+        - engine (ASREngine, opcional): Motor de detección; por defecto, el del nivel de reposo.
+        - ventana (float): Segundos iniciales de la frase que se analizan.
+        - patron (re.Pattern): Expresión que debe aparecer en la transcripción.
+        """
+        self._engine = engine
+        self.ventana = ventana
+        self.patron = patron
+        self.ultimo_texto = None  # Transcripción de la última ventana analizada
+        self.ultimas_muestras = 0  # Muestras de audio que cubre esa transcripción
+        self.ultima_confianza = None  # Métricas de confianza de esa transcripción
+        self.detectadas = 0  # Frases en las que se encontró la activación
+        self.descartadas = 0  # Frases descartadas sin transcripción completa
+
+    @property
+    def engine(self):
+        """Motor usado para la detección."""
+        return self._engine or model_tiers.engine(TIER_REPOSO)
+
+    def detectar(self, audio_array):
+        """
+        Indica si la frase contiene la palabra de activación en sus primeros segundos.
+
+        Parámetros:
+        - audio_array (np.ndarray): Audio de la frase (float32, 16 kHz).
+
+        Retorna:
+        - (bool): True si se detectó la frase de activación o de apagado.
+        """
+        fragmento = audio_array[:int(self.ventana * SAMPLE_RATE)]
+        texto, self.ultima_confianza = self.engine.transcribir_con_confianza(
+            fragmento, beam_size=1, without_timestamps=True, condition_on_previous_text=False
+        )
+        self.ultimo_texto = texto.strip()
+        self.ultimas_muestras = len(fragmento)
+
+        if self.patron.search(texto):
+            self.detectadas += 1
+            print(f"ASR -> Activación detectada: {texto.strip()}")
+            return True
+
+        self.descartadas += 1
+        return False
+
+    def estado(self):
+        """Devuelve los contadores del detector para diagnóstico."""
+        return {"detectadas": self.detectadas, "descartadas": self.descartadas}
+
+
+wake_word_spotter = WakeWordSpotter()
+
+
+def _contiene_comando(texto):
+    """Indica si tras la frase de activación hay más palabras (un comando que transcribir bien)."""
+    match = PATRON_ACTIVACION.search(texto)
+    resto = texto[match.end():] if match else texto
+    return re.search(r'\w', resto) is not None
+
+
+def transcribir_segun_estado(audio_array, solo_activacion=False):
+    """
+    Transcribe una frase con el nivel de modelo que corresponde a la conversación.
+
+    - Conversación activa: modelo del nivel activo.
+    - Conversación inactiva: el detector busca la activación en la ventana
+      inicial; si no aparece la frase se descarta. Si aparece, la frase se
+      transcribe con el modelo de reposo (o se reutiliza la ventana si la cubre
+      entera) y solo se pasa al nivel activo cuando hay un comando tras la
+      activación ("oye pato, añade..."), para no perder precisión en las tareas.
+      La frase de activación o apagado se devuelve en su forma canónica.
+
+    Retorna:
+    - (str | None, dict): Texto transcrito (None si se descarta) y nivel usado,
+      con las métricas de confianza si hubo transcripción.
+    """
+    if not solo_activacion:
+        return model_tiers.transcribir(audio_array, TIER_ACTIVO)
+
+    if not wake_word_spotter.detectar(audio_array):
+        return None, model_tiers.info(TIER_REPOSO)
+    return _transcribir_tras_activacion(audio_array)
+
+
+def _transcribir_tras_activacion(audio_array, transcribir_reposo=True):
+    """
+    Transcribe una frase en la que `wake_word_spotter` ya encontró la activación.
+
+    Si la última ventana del detector cubre toda la frase se reutiliza su texto;
+    si no, y `transcribir_reposo` es True, se transcribe con el modelo de reposo.
+    Solo se pasa al nivel activo cuando hay un comando tras la activación (o no
+    hay texto de reposo que reutilizar), de modo que "oye pato" o "apagar pato"
+    a secas nunca usan el modelo activo.
+
+    Retorna:
+    - (str, dict): Texto con la activación en forma canónica y nivel usado.
+    """
+    texto, info = None, None
+    if len(audio_array) <= wake_word_spotter.ultimas_muestras:
+        model_tiers.usos[TIER_REPOSO] += 1
+        texto = wake_word_spotter.ultimo_texto
+        info = {**model_tiers.info(TIER_REPOSO), **wake_word_spotter.ultima_confianza}
+    elif transcribir_reposo:
+        texto, info = model_tiers.transcribir(audio_array, TIER_REPOSO)
+
+    if texto is None or _contiene_comando(texto):
+        texto, info = model_tiers.transcribir(audio_array, TIER_ACTIVO)
+    return normalizar_activacion(texto), info
+
+
+# Frases que Whisper suele inventar sobre silencio o ruido. Deben cubrir la
+# frase entera (normalizada), para no descartar comandos que solo las contienen
+ALUCINACIONES_CONOCIDAS = re.compile(
+    r'subtitul(?:os|ado)(?: (?:realizados|hechos|creados|por) .*)?'
+    r'|.*\bamara org\b.*'
+    r'|(?:muchas )?gracias por ver(?: el video)?'
+    r'|suscribete(?: .*)?'
+)
+
+
+class ConfidenceGate:
+    """
+    Filtro de confianza para las transcripciones.
+
+    Whisper devuelve texto aunque la entrada sea ruido, y cada frase aceptada
+    desencadena SER, NLU y posiblemente una llamada al LLM. Con las métricas de
+    confianza de la transcripción se descartan antes de llegar al gestor de
+    diálogo las frases que parecen silencio, alucinaciones repetitivas o texto
+    de muy baja probabilidad. Los umbrales por defecto son los que usa Whisper
+    internamente para decidir si un segmento es silencio (`no_speech_threshold`
+    0.6 con `log_prob_threshold` -1.0) o debe reintentarse (`compression_ratio_threshold`
+    2.4, `log_prob_threshold` -1.0).
+    """
+
+    def __init__(self, min_avg_logprob=-1.0, max_no_speech_prob=0.6, max_logprob_sin_voz=-1.0,
+                 max_compression_ratio=2.4, alucinaciones=ALUCINACIONES_CONOCIDAS):
+        """
+        Configura los umbrales del filtro.
+
+        Parámetros:
+        - min_avg_logprob (float): Log-probabilidad media mínima aceptada.
+        - max_no_speech_prob (float): Probabilidad de silencio a partir de la cual
+          la frase se descarta si además su log-probabilidad es baja.
+        - max_logprob_sin_voz (float): Log-probabilidad media por debajo de la cual
+          una frase con probabilidad de silencio alta se considera silencio.
+        - max_compression_ratio (float): Ratio de compresión máximo (texto repetitivo).
+        - alucinaciones (re.Pattern | None): Frases típicas de alucinación que se descartan
+          cuando son toda la transcripción (se comparan con el texto normalizado).
+        """
+        self.min_avg_logprob = min_avg_logprob
+        self.max_no_speech_prob = max_no_speech_prob
+        self.max_logprob_sin_voz = max_logprob_sin_voz
+        self.max_compression_ratio = max_compression_ratio
+        self.alucinaciones = alucinaciones
+        self.aceptadas = 0
+        self.descartadas = 0
+        self.motivos = collections.Counter()  # Frases descartadas por motivo
+
+    def motivo_rechazo(self, texto, info):
+        """Devuelve el motivo por el que se descartaría la frase, o None si se acepta."""
+        if self.alucinaciones and self.alucinaciones.fullmatch(normalizar(texto)):
+            return "alucinacion_conocida"
+        if not info or info.get("avg_logprob") is None:
+            return None  # Sin métricas no hay base para descartar
+
+        if info["compression_ratio"] > self.max_compression_ratio:
+            return "texto_repetitivo"
+        if info["no_speech_prob"] > self.max_no_speech_prob and info["avg_logprob"] < self.max_logprob_sin_voz:
+            return "sin_voz"
+        if info["avg_logprob"] < self.min_avg_logprob:
+            return "baja_confianza"
+        return None
+
+    def aceptar(self, texto, info):
+        """
+        Decide si una frase pasa al gestor de diálogo y actualiza los contadores.
+
+        Retorna:
+        - (bool): True si la frase se acepta.
+        """
+        motivo = self.motivo_rechazo(texto, info)
+        if motivo is None:
+            self.aceptadas += 1
+            return True
+
+        self.descartadas += 1
+        self.motivos[motivo] += 1
+        print(f"ASR -> Frase descartada ({motivo}): {texto}")
+        return False
+
+    def estado(self):
+        """Devuelve los contadores del filtro para diagnóstico."""
+        return {"aceptadas": self.aceptadas, "descartadas": self.descartadas, "motivos": dict(self.motivos)}
+
+
+confidence_gate = ConfidenceGate()
+
+
+@contextlib.contextmanager
+def microfono(prioritario=True):
+    """
+    Da acceso exclusivo al micrófono compartido, abriéndolo la primera vez.
+
+    El stream se mantiene abierto entre usos para no pagar su apertura en cada
+    comando. Los accesos prioritarios (escuchar un comando) avisan al estimador
+    de ruido para que libere el micrófono cuanto antes.
+    """
+    global source
+    if prioritario:
+        _mic_solicitado.set()
+    try:
+        with _mic_lock:
+            if prioritario:
+                _mic_solicitado.clear()
+            if source is None:
+                source = sr.Microphone().__enter__()
+            yield source
+    finally:
+        if prioritario:
+            _mic_solicitado.clear()
+
+
+def energia_rms(chunk, sample_width):
+    """Calcula la energía RMS de un fragmento PCM, en la misma escala que `energy_threshold`."""
+    dtype = np.int16 if sample_width == 2 else np.int32
+    samples = np.frombuffer(chunk, dtype=dtype).astype(np.float64)
+    return float(np.sqrt(np.mean(samples ** 2))) if samples.size else 0.0
+
+
+class NoiseFloorTracker:
+    """
+    Estimador continuo del nivel de ruido ambiente.
+
+    Mientras nadie está escuchando un comando, un hilo en segundo plano lee el
+    micrófono y calcula el suelo de ruido como un percentil bajo de la energía
+    de los últimos segundos (robusto frente a voz breve). A partir de él
+    mantiene `recognizer.energy_threshold`, de modo que la escucha empieza
+    inmediatamente sin el segundo de `adjust_for_ambient_noise`. Los fragmentos
+    grabados mientras suena PATO (según `en_reproduccion`) se descartan, porque
+    el eco del TTS elevaría el umbral hasta el nivel de la voz.
+    """
+
+    def __init__(self, recognizer, ventana=3.0, percentil=20, umbral_minimo=50.0, en_reproduccion=None):
+        """
+        Configura el estimador sin arrancar el hilo de seguimiento.
+
+        Parámetros:
+        - recognizer (sr.Recognizer): Reconocedor cuyo umbral se mantiene actualizado.
+        - ventana (float): Segundos de audio considerados en la estimación.
+        - percentil (float): Percentil de energía que se toma como suelo de ruido.
+        - umbral_minimo (float): Valor mínimo de `energy_threshold`.
+        - en_reproduccion (callable, opcional): Indica si el altavoz está sonando
+          (p. ej. `TTS.en_reproduccion`); mientras devuelva True no se estima el ruido.
+        """
+        self.recognizer = recognizer
+        self.en_reproduccion = en_reproduccion or (lambda: False)
+        self.descartados_eco = 0  # Fragmentos ignorados por coincidir con el TTS
+        self.ventana = ventana
+        self.percentil = percentil
+        self.umbral_minimo = umbral_minimo
+        self.energias = collections.deque()
+        self.nivel_ruido = None  # Último suelo de ruido estimado
+        self.ultima_actualizacion = None
+        self._hilo = None
+        self._detener = threading.Event()
+
+    @property
+    def activo(self):
+        """Indica si el hilo de seguimiento está en marcha y ya tiene una estimación."""
+        return self._hilo is not None and self._hilo.is_alive() and self.nivel_ruido is not None
+
+    def actualizar(self, energia, duracion):
+        """
+        Incorpora la energía de un fragmento de audio y recalcula el umbral.
+
+        Parámetros:
+        - energia (float): Energía RMS del fragmento.
+        - duracion (float): Duración del fragmento en segundos.
+        """
+        maximo = max(1, int(self.ventana / duracion))
+        if self.energias.maxlen != maximo:
+            self.energias = collections.deque(self.energias, maxlen=maximo)
+        self.energias.append(energia)
+
+        self.nivel_ruido = float(np.percentile(self.energias, self.percentil))
+        self.recognizer.energy_threshold = max(
+            self.umbral_minimo, self.nivel_ruido * self.recognizer.dynamic_energy_ratio
+        )
+        self.ultima_actualizacion = time.time()
+
+    def estado(self):
+        """Devuelve el estado actual del estimador para diagnóstico."""
+        return {
+            "activo": self.activo,
+            "nivel_ruido": self.nivel_ruido,
+            "energy_threshold": self.recognizer.energy_threshold,
+            "muestras": len(self.energias),
+            "descartados_eco": self.descartados_eco,
+            "ultima_actualizacion": self.ultima_actualizacion,
+        }
+
+    def iniciar(self):
+        """Arranca el hilo de seguimiento si no está ya en marcha."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo de seguimiento."""
+        self._detener.set()
+
+    def _bucle(self):
+        """Lee fragmentos del micrófono mientras está libre y actualiza la estimación."""
+        while not self._detener.is_set():
+            if _mic_solicitado.is_set():
+                time.sleep(0.01)  # Ceder el micrófono a la escucha de comandos
+                continue
+            try:
+                with microfono(prioritario=False) as audio:
+                    chunk = audio.stream.read(audio.CHUNK)
+                    duracion = audio.CHUNK / audio.SAMPLE_RATE
+                    sample_width = audio.SAMPLE_WIDTH
+            except Exception as e:
+                print(f"ERROR: El estimador de ruido no pudo leer el micrófono: {e}")
+                time.sleep(1)
+                continue
+            if self.en_reproduccion():
+                self.descartados_eco += 1
+                continue
+            self.actualizar(energia_rms(chunk, sample_width), duracion)
+
+
+noise_tracker = NoiseFloorTracker(recognizer)
+
+
+def iniciar_seguimiento_ruido(en_reproduccion=None):
+    """
+    Arranca el estimador de ruido ambiente en segundo plano.
+
+    Parámetros:
+    - en_reproduccion (callable, opcional): Indica si PATO está hablando, para no
+      estimar el ruido sobre su propia voz (p. ej. `TTS.en_reproduccion`).
+    """
+    if en_reproduccion:
+        noise_tracker.en_reproduccion = en_reproduccion
+    noise_tracker.iniciar()
+    return noise_tracker
+
+
+def _ajustar_ruido(audio):
+    """Calibra el umbral con `adjust_for_ambient_noise` solo si no hay estimación en segundo plano."""
+    if not noise_tracker.activo:
+        recognizer.adjust_for_ambient_noise(audio)
+
+
+class Endpointer:
+    """
+    Endpointing adaptativo para el modo streaming.
+
+    En lugar de esperar siempre `recognizer.pause_threshold` segundos de
+    silencio, decide la espera a partir de la última transcripción parcial:
+    - Comando completo (una frase de control de `rasa/nlu.yml`, "apagar pato",
+      o activación + verbo con algo detrás): espera corta.
+    - Frase a medias (solo la activación, o termina en coma o en una palabra de
+      enlace): espera larga, porque el usuario suele hacer una pausa antes del comando.
+    - Resto de casos o sin parcial al día: espera base.
+
+    Las frases de control se comprueban antes que las palabras de enlace, de modo
+    que una orden completa como "oye pato, para ya" no espera como si la frase
+    siguiera. Una palabra suelta que también es enlace ("para") no es una frase
+    de control, por lo que "oye pato, para..." a media frase recibe la espera larga.
+    """
+
+    VERBOS = (
+        "añade", "agrega", "apunta", "anota", "elimina", "borra", "quita", "completa", "marca",
+        "modifica", "cambia", "deshaz", "dime", "muestra", "lista", "consulta", "recuérdame",
+    )
+    ENLACES = (
+        "y", "e", "o", "u", "ni", "de", "del", "que", "para", "con", "a", "al", "en", "el", "la",
+        "los", "las", "un", "una", "mi", "mis", "por", "pero", "porque", "como", "sobre", "hasta",
+        "si", "cuando", "donde", "tarea",
+    )
+
+    def __init__(self, pausa_completa=0.35, pausa_base=None, pausa_incompleta=1.5, pausa_minima=0.2, pausa_maxima=2.0,
+                 frases_control=None):
+        """
+        Configura los tiempos de espera (en segundos).
+
+        Parámetros:
+        - pausa_completa (float): Silencio tras un comando completo.
+        - pausa_base (float, opcional): Silencio por defecto; si es None se usa `recognizer.pause_threshold`.
+        - pausa_incompleta (float): Silencio tras una frase a medias.
+        - pausa_minima (float): Límite inferior de cualquier espera.
+        - pausa_maxima (float): Límite superior de cualquier espera.
+        - frases_control (ControlPhraseMatcher, opcional): Reconocedor de frases de control;
+          por defecto se construye desde `rasa/nlu.yml` en el primer uso.
+        """
+        self._frases_control = frases_control
+        self.pausa_completa = pausa_completa
+        self.pausa_base = pausa_base
+        self.pausa_incompleta = pausa_incompleta
+        self.pausa_minima = pausa_minima
+        self.pausa_maxima = pausa_maxima
+        self.historial = collections.deque(maxlen=100)  # Últimos endpoints elegidos
+
+        activacion = r'(?:oye,?\s+pato)'
+        self._solo_activacion = re.compile(rf'^\W*{activacion}\W*$', re.IGNORECASE)
+        self._completa = re.compile(
+            rf'^\W*(?:apagar,?\s+pato\W*|{activacion}\W*(?:{"|".join(self.VERBOS)})\b.*\w.*)$',
+            re.IGNORECASE
+        )
+        self._incompleta = re.compile(rf'(?:,|\b(?:{"|".join(self.ENLACES)}))\W*$', re.IGNORECASE)
+
+    @property
+    def frases_control(self):
+        """
+        Reconocedor de frases de control construido desde `rasa/nlu.yml`, igual que el
+        de `DialogManager` pero en una instancia propia, para que las consultas de las
+        parciales no alteren sus contadores de aciertos.
+        """
+        if self._frases_control is None:
+            from NLU import ControlPhraseMatcher
+            self._frases_control = ControlPhraseMatcher()
+        return self._frases_control
+
+    def pausa(self, texto_parcial):
+        """
+        Devuelve el silencio a esperar dada la parcial que cubre todo lo dicho.
+
+        Parámetros:
+        - texto_parcial (str | None): Parcial al día, o None si no la hay.
+
+        Retorna:
+        - (float, str): Segundos de silencio y motivo de la elección.
+        """
+        base = self.pausa_base if self.pausa_base is not None else recognizer.pause_threshold
+
+        if not texto_parcial:
+            pausa, motivo = base, "sin_parcial"
+        elif self.frases_control.buscar(texto_parcial):
+            pausa, motivo = self.pausa_completa, "frase_control"
+        elif self._solo_activacion.match(texto_parcial):
+            pausa, motivo = self.pausa_incompleta, "solo_activacion"
+        elif self._incompleta.search(texto_parcial):
+            pausa, motivo = self.pausa_incompleta, "frase_incompleta"
+        elif self._completa.match(texto_parcial):
+            pausa, motivo = self.pausa_completa, "comando_completo"
+        else:
+            pausa, motivo = base, "base"
+
+        return min(self.pausa_maxima, max(self.pausa_minima, pausa)), motivo
+
+    def registrar(self, pausa, motivo, silencio, texto):
+        """Registra y muestra el endpoint elegido en un turno."""
+        self.historial.append({"pausa": pausa, "motivo": motivo, "silencio": silencio, "texto": texto})
+        print(f"ASR -> Fin de frase tras {silencio:.2f} s de silencio (espera {pausa:.2f} s, {motivo})")
+
+
+endpointer = Endpointer()
+
+
+# Parámetros del modo streaming
+STREAMING_PAUSA_PARCIAL = 0.3  # Silencio (s) que dispara una transcripción parcial
+STREAMING_INTERVALO_PARCIAL = 1.0  # Voz nueva (s) que dispara una parcial aunque no haya pausa
+STREAMING_PRE_ROLL = 0.3  # Audio (s) previo al inicio de la voz que se conserva
+
+# Un único hilo para las transcripciones parciales: nunca hay dos en paralelo
+_executor_parciales = ThreadPoolExecutor(max_workers=1)
+
+
+def audio_data_to_array(audio_data):
+    """
+    Convierte un `sr.AudioData` en un array float32 mono a 16 kHz.
+
+    Parámetros:
+    - audio_data (sr.AudioData): Audio capturado por `speech_recognition`.
+
+    Retorna:
+    - (np.ndarray): Muestras normalizadas en el rango [-1, 1].
+    """
+    raw = audio_data.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=2)
+    return np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def guardar_audio_debug(audio_data):
+    """
+    Guarda el audio capturado en `Resources/` con un nombre único.
+
+    Solo se usa cuando `DEBUG_AUDIO` está activo; el nombre con marca de tiempo
+    evita que dos frases consecutivas se sobrescriban entre sí.
+    """
+    file_path = os.path.join("Resources", f"command_{time.time_ns()}.wav")
+    with open(file_path, "wb") as f:
+        f.write(audio_data.get_wav_data())
+    print(f"ASR -> Audio de depuración guardado en {file_path}")
+    return file_path
+
+
+def transcribir(audio):
+    """
+    Transcribe audio con Whisper.
+
+    Parámetros:
+    - audio (str | np.ndarray): Ruta de un archivo o buffer float32 a 16 kHz.
+
+    Retorna:
+    - (str): Texto transcrito.
+    """
+    return engine.transcribir(audio)
+
+
+def listen_for_command(solo_activacion=False):
+    """
+    Escucha un comando a través del micrófono y lo transcribe con Whisper
+    directamente desde memoria.
+
+    Parámetros:
+    - solo_activacion (bool): Si es True (conversación inactiva), se usa el nivel
+      de reposo y la frase solo se transcribe si se detecta la activación.
 
     Retorna:
     - command (str): Texto transcrito del comando.
-    - file_path (str): Ruta del archivo de audio grabado.
+    - audio (np.ndarray): Audio del comando (float32, 16 kHz).
+    - info (dict): Nivel de modelo usado (`{"tier", "modelo"}`).
 
-    Si no se detecta un comando válido, devuelve (None, None).
+    Si no se detecta un comando válido, devuelve (None, None, info).
     """
-    with source as audio:
+    with microfono() as audio:
         print("\nASR -> Escuchando comandos...")
-        recognizer.adjust_for_ambient_noise(audio)  # Ajustar ruido ambiente
+        _ajustar_ruido(audio)  # Ajustar ruido ambiente si no hay estimación continua
         recorded_audio = recognizer.listen(audio)  # Capturar audio del micrófono
 
     try:
-        file_path = os.path.join("Resources", "command.wav")
-
-        # Guardar el audio grabado en un archivo temporal
-        with open(file_path, "wb") as f:
-            f.write(recorded_audio.get_wav_data())
-
-        command = ""
-        # Transcribir el audio con Whisper
-        segments, info = whisper_model.transcribe(file_path, language="es")
-        
-        for segment in segments:
-            command += segment.text
-                
+        audio_array = audio_data_to_array(recorded_audio)
+
+        if DEBUG_AUDIO:
+            guardar_audio_debug(recorded_audio)
+
+        # Transcribir el audio con Whisper sin pasar por disco
+        command, info = transcribir_segun_estado(audio_array, solo_activacion)
+
         if command and command != "":
-            print(f"\nASR -> Frase detectada: {command}")
-            return command, file_path
+            print(f"\nASR -> Frase detectada ({info['tier']}, {info['modelo']}): {command}")
+            return command, audio_array, info
 
-        return None, None
+        return None, None, info
 
     except sr.UnknownValueError:
         print("ERROR: No se pudo entender el audio. Intenta nuevamente.")
-        return None, None
-    
-    
+        return None, None, None
+
+
+def transcribir_frase(audio_array, solo_activacion=False):
+    """
+    Transcribe una frase capturada previamente en memoria.
+
+    Parámetros:
+    - audio_array (np.ndarray | None): Audio de la frase (float32, 16 kHz).
+    - solo_activacion (bool): Si es True, se usa el nivel de reposo y solo se
+      transcribe si se detecta la activación.
+
+    Retorna:
+    - command (str): Texto transcrito del comando.
+    - audio (np.ndarray): El mismo audio recibido.
+    - info (dict): Nivel de modelo usado (`{"tier", "modelo"}`).
+
+    Si no hay audio o no se detecta texto, devuelve (None, None, info).
+    """
+    if audio_array is None or audio_array.size == 0:
+        return None, None, None
+
+    command, info = transcribir_segun_estado(audio_array, solo_activacion)
+    command = command.strip() if command else None
+    if command:
+        print(f"\nASR -> Frase detectada ({info['tier']}, {info['modelo']}): {command}")
+        return command, audio_array, info
+
+    return None, None, info
+
+
+def pcm_to_array(raw, sample_rate, sample_width):
+    """Convierte audio PCM crudo del micrófono en un array float32 a 16 kHz."""
+    return audio_data_to_array(sr.AudioData(raw, sample_rate, sample_width))
+
+
+def _transcribir_si_activado(audio_array, activacion):
+    """
+    Transcribe una parcial solo si la frase ya contiene la palabra de activación.
+
+    `activacion` se comparte entre las parciales de una misma frase: cuando el
+    detector la encuentra deja de consultarse, y si la ventana inicial ya se ha
+    superado sin encontrarla se da la frase por descartada. Con la conversación
+    inactiva, mientras la ventana del detector cubre la parcial se reutiliza su
+    texto (nivel de reposo) y el modelo activo solo se usa si hay un comando tras
+    la activación; el texto se devuelve con la activación en forma canónica,
+    igual que en `transcribir_segun_estado`.
+    """
+    if not activacion["detectada"]:
+        if activacion["descartada"]:
+            return "", None
+        activacion["detectada"] = wake_word_spotter.detectar(audio_array)
+        if not activacion["detectada"]:
+            activacion["descartada"] = len(audio_array) >= wake_word_spotter.ventana * SAMPLE_RATE
+            return "", None
+    if activacion["solo_activacion"]:
+        return _transcribir_tras_activacion(audio_array, transcribir_reposo=False)
+    return model_tiers.transcribir(audio_array, TIER_ACTIVO)
+
+
+def escuchar_en_streaming(on_parcial=None, solo_activacion=False):
+    """
+    Escucha un comando y lo transcribe por tramos mientras el usuario sigue hablando.
+
+    El audio se segmenta por energía: cada pausa corta (`STREAMING_PAUSA_PARCIAL`)
+    o cada `STREAMING_INTERVALO_PARCIAL` segundos de voz nueva se lanza una
+    transcripción de todo lo dicho hasta ahora en un hilo aparte, sin dejar de
+    leer del micrófono. El silencio que marca el fin de frase lo decide
+    `endpointer` a partir de la última parcial (corto si ya es un comando
+    completo, largo si la frase quedó a medias); si esa parcial ya cubre todo el
+    audio se reutiliza como resultado final y no se vuelve a ejecutar Whisper.
+
+    Parámetros:
+    - on_parcial (callable, opcional): Función que recibe cada hipótesis parcial.
+    - solo_activacion (bool): Si es True, no se emiten parciales ni resultado
+      hasta que `wake_word_spotter` detecta la frase de activación; después se
+      transcribe como en `transcribir_segun_estado` (nivel de reposo para la
+      activación o el apagado a secas, nivel activo si hay un comando).
+
+    Produce:
+    - (dict): Hipótesis `{"texto": str, "final": bool, "audio": np.ndarray | None, "info": dict}`,
+      donde `info` indica el nivel de modelo usado. La última hipótesis emitida
+      siempre tiene `final=True`; si no se entendió nada, su texto es None.
+    """
+    with microfono() as audio:
+        print("\nASR -> Escuchando comandos (streaming)...")
+        _ajustar_ruido(audio)
+
+        chunk_duration = audio.CHUNK / audio.SAMPLE_RATE
+        pre_roll = collections.deque(maxlen=max(1, int(STREAMING_PRE_ROLL / chunk_duration)))
+        frames = []
+        hablando = False
+        silencio = 0.0
+        voz_sin_parcial = 0.0
+        parcial_futuro = None  # Transcripción parcial en curso
+        ultima_parcial = (None, None)  # Texto e info de la última parcial terminada
+        activacion = {"detectada": not solo_activacion, "descartada": False, "solo_activacion": solo_activacion}
+
+        while True:
+            chunk = audio.stream.read(audio.CHUNK)
+            if not chunk:
+                break
+
+            energia = energia_rms(chunk, audio.SAMPLE_WIDTH)
+
+            if not hablando:
+                pre_roll.append(chunk)
+                if energia > recognizer.energy_threshold:
+                    hablando = True
+                    frames.extend(pre_roll)
+                continue
+
+            frames.append(chunk)
+            if energia > recognizer.energy_threshold:
+                silencio = 0.0
+                voz_sin_parcial += chunk_duration
+            else:
+                silencio += chunk_duration
+
+            # Recoger la parcial en curso sin bloquear la lectura del micrófono
+            if parcial_futuro and parcial_futuro.done():
+                texto, info = parcial_futuro.result()
+                texto = texto.strip()
+                ultima_parcial = (texto, info)
+                parcial_futuro = None
+                if texto:
+                    hipotesis = {"texto": texto, "final": False, "audio": None, "info": info}
+                    print(f"ASR -> Parcial: {texto}")
+                    if on_parcial:
+                        on_parcial(hipotesis)
+                    yield hipotesis
+
+            # La parcial solo sirve para decidir el endpoint si cubre toda la voz
+            parcial_al_dia = parcial_futuro is None and voz_sin_parcial == 0
+            pausa, motivo = endpointer.pausa(ultima_parcial[0] if parcial_al_dia else None)
+            if silencio >= pausa:
+                endpointer.registrar(pausa, motivo, silencio, ultima_parcial[0])
+                break
+
+            pausa_corta = silencio >= STREAMING_PAUSA_PARCIAL and voz_sin_parcial > 0
+            if parcial_futuro is None and (pausa_corta or voz_sin_parcial >= STREAMING_INTERVALO_PARCIAL):
+                audio_parcial = pcm_to_array(b"".join(frames), audio.SAMPLE_RATE, audio.SAMPLE_WIDTH)
+                parcial_futuro = _executor_parciales.submit(_transcribir_si_activado, audio_parcial, activacion)
+                voz_sin_parcial = 0.0
+
+        sample_rate, sample_width = audio.SAMPLE_RATE, audio.SAMPLE_WIDTH
+
+    if not frames:
+        yield {"texto": None, "final": True, "audio": None, "info": None}
+        return
+
+    raw = b"".join(frames)
+    audio_array = pcm_to_array(raw, sample_rate, sample_width)
+
+    if DEBUG_AUDIO:
+        guardar_audio_debug(sr.AudioData(raw, sample_rate, sample_width))
+
+    # Fin de frase anticipado: si desde la última parcial solo hubo silencio,
+    # esa parcial ya cubre toda la voz y no hace falta volver a transcribir
+    if parcial_futuro:
+        texto, info = parcial_futuro.result()
+        ultima_parcial = (texto.strip(), info)
+    voz_cubierta = voz_sin_parcial == 0
+
+    if activacion["detectada"]:
+        if ultima_parcial[0] and voz_cubierta:
+            command, info = ultima_parcial
+        elif solo_activacion:
+            command, info = _transcribir_tras_activacion(audio_array)
+        else:
+            command, info = model_tiers.transcribir(audio_array, TIER_ACTIVO)
+    elif activacion["descartada"]:
+        command, info = None, model_tiers.info(TIER_REPOSO)
+    else:
+        command, info = transcribir_segun_estado(audio_array, solo_activacion=True)
+    command = command.strip() if command else None
+
+    if command:
+        print(f"\nASR -> Frase detectada ({info['tier']}, {info['modelo']}): {command}")
+        yield {"texto": command, "final": True, "audio": audio_array, "info": info}
+    else:
+        yield {"texto": None, "final": True, "audio": None, "info": info}
+
+
 def transcribe_audio_file(audio_path):
     """
     Transcribe un archivo de audio usando Faster Whisper.
@@ -91,13 +1108,88 @@ def transcribe_audio_file(audio_path):
         return None
 
     try:
-        transcription = ""
-        segments, _ = whisper_model.transcribe(audio_path, language="es")
-        for segment in segments:
-            transcription += segment.text
-        return transcription
+        return transcribir(audio_path)
 
     except Exception as e:
         print(f"ERROR al transcribir {audio_path}: {e}")
         return None
 
+
+# Modelos dedicados a la transcripción en lote, indexados por número de hilos
+_modelos_lote = {}
+
+
+def _modelo_lote(workers):
+    """
+    Devuelve un modelo Whisper preparado para `workers` hilos concurrentes.
+
+    CTranslate2 libera el GIL, así que con `num_workers` > 1 varias llamadas a
+    `transcribe()` desde hilos distintos se ejecutan realmente en paralelo. Los
+    núcleos de CPU se reparten entre los hilos para no sobresuscribir la máquina.
+    """
+    if workers <= 1:
+        return engine.model
+    if workers not in _modelos_lote:
+        cpu_threads = max(1, (os.cpu_count() or 1) // workers)
+        _modelos_lote[workers] = ASREngine(
+            engine.model_size, device=engine.device, compute_type=engine.compute_type,
+            cpu_threads=cpu_threads, num_workers=workers, language=engine.language
+        )
+    return _modelos_lote[workers].model
+
+
+def _transcribir_archivo_medido(model, audio_path, batch_size):
+    """Transcribe un archivo y devuelve el texto junto con su tiempo y factor de tiempo real."""
+    resultado = {"path": audio_path, "texto": None, "tiempo": None, "duracion": None, "rtf": None}
+
+    if not os.path.exists(audio_path):
+        print(f"ERROR: No se encontró el archivo {audio_path}.")
+        return resultado
+
+    try:
+        inicio = time.perf_counter()
+        if batch_size > 1:
+            segments, info = BatchedInferencePipeline(model=model).transcribe(
+                audio_path, language=engine.language, batch_size=batch_size
+            )
+        else:
+            segments, info = model.transcribe(audio_path, language=engine.language)
+        texto = "".join(segment.text for segment in segments)  # Los segmentos se decodifican aquí
+        tiempo = time.perf_counter() - inicio
+
+        resultado.update(
+            texto=texto, tiempo=tiempo, duracion=info.duration,
+            rtf=tiempo / info.duration if info.duration else None
+        )
+    except Exception as e:
+        print(f"ERROR al transcribir {audio_path}: {e}")
+
+    return resultado
+
+
+def transcribe_audio_files(paths, batch_size=8, workers=1):
+    """
+    Transcribe varios archivos de audio y devuelve los resultados en orden.
+
+    Cada archivo se decodifica con el pipeline por lotes de faster_whisper
+    (`batch_size` segmentos por inferencia) y, si `workers` > 1, varios archivos
+    se procesan a la vez en hilos que comparten un modelo con `num_workers`.
+
+    Parámetros:
+    - paths (iterable[str]): Rutas de los archivos de audio.
+    - batch_size (int): Segmentos por lote; 1 usa la decodificación secuencial.
+    - workers (int): Número de archivos que se transcriben en paralelo.
+
+    Produce:
+    - (dict): `{"path", "texto", "tiempo", "duracion", "rtf"}` por archivo, en el
+      mismo orden que `paths`. `texto` es None si el archivo no se pudo transcribir.
+    """
+    model = _modelo_lote(workers)
+
+    if workers <= 1:
+        for audio_path in paths:
+            yield _transcribir_archivo_medido(model, audio_path, batch_size)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(lambda path: _transcribir_archivo_medido(model, path, batch_size), paths)
@@ -0,0 +1,253 @@
+"""
+AudioCapture.py - Captura continua de audio del micrófono
+
+Este módulo mantiene el micrófono abierto en un hilo dedicado para que no se
+pierda nada de lo que dice el usuario mientras PATO está pensando o hablando.
+
+Funcionalidad:
+- Hilo de captura que escribe fragmentos PCM en un buffer circular acotado.
+- Segmentador que detecta frases completas por energía y las encola para el
+  gestor de diálogo.
+- Supresión de eco: los fragmentos grabados mientras suena el TTS se descartan
+  para que PATO no se escuche a sí mismo.
+- Contabilidad de desbordamientos: fragmentos sobrescritos antes de ser
+  segmentados y frases descartadas por tener la cola llena.
+
+Dependencias:
+- `ASR`: Micrófono compartido, reconocedor (umbral de energía y pausa),
+  estimador de ruido y conversión del audio a float32 a 16 kHz.
+- `TTS`: Estado de reproducción del altavoz.
+- `threading` y `queue`: Para los hilos de captura y segmentación.
+
+Clases:
+- `RingBuffer`: Buffer circular de fragmentos de audio con retención configurable.
+- `CapturaContinua`: Hilo de captura y segmentador con cola de frases.
+"""
+
+import collections
+import itertools
+import queue
+import threading
+import speech_recognition as sr
+import ASR
+import TTS
+
+
+class RingBuffer:
+    """
+    Buffer circular de fragmentos de audio.
+
+    Cada fragmento tiene una posición absoluta creciente. Un lector que se
+    retrasa más de la capacidad del buffer pierde los fragmentos sobrescritos,
+    que se contabilizan en `perdidos`.
+    """
+
+    def __init__(self, capacidad):
+        """
+        Crea un buffer vacío.
+
+        Parámetros:
+        - capacidad (int): Número máximo de fragmentos retenidos.
+        """
+        self.capacidad = capacidad
+        self.fragmentos = collections.deque(maxlen=capacidad)
+        self.escritos = 0  # Posición absoluta del siguiente fragmento
+        self.perdidos = 0  # Fragmentos sobrescritos antes de ser leídos
+        self._cond = threading.Condition()
+
+    def escribir(self, fragmento):
+        """Añade un fragmento, sobrescribiendo el más antiguo si el buffer está lleno."""
+        with self._cond:
+            self.fragmentos.append(fragmento)
+            self.escritos += 1
+            self._cond.notify_all()
+
+    def leer_desde(self, posicion, timeout=None):
+        """
+        Devuelve los fragmentos disponibles a partir de una posición absoluta.
+
+        Espera hasta `timeout` segundos si todavía no hay fragmentos nuevos.
+
+        Retorna:
+        - (list[bytes], int): Fragmentos leídos y posición desde la que seguir leyendo.
+        """
+        with self._cond:
+            if posicion >= self.escritos:
+                self._cond.wait(timeout)
+
+            primero = self.escritos - len(self.fragmentos)
+            if posicion < primero:
+                self.perdidos += primero - posicion
+                posicion = primero
+
+            return list(itertools.islice(self.fragmentos, posicion - primero, None)), self.escritos
+
+
+class CapturaContinua:
+    """
+    Captura continua del micrófono con segmentación de frases en segundo plano.
+
+    Un hilo lee el micrófono sin pausa y escribe en un `RingBuffer`; otro hilo
+    segmenta el audio por energía (con el umbral que mantiene `ASR.noise_tracker`
+    y la pausa de `ASR.recognizer`) y deja cada frase completa en una cola
+    acotada. Los fragmentos grabados mientras suena el TTS se marcan como eco y
+    no llegan a ninguna frase ni al estimador de ruido. Mientras está en marcha ocupa el micrófono compartido de `ASR`, por
+    lo que `ASR.listen_for_command()` no debe usarse a la vez.
+    """
+
+    def __init__(self, retencion=10.0, max_frases=5, pre_roll=0.3, duracion_minima=0.2, duracion_maxima=30.0):
+        """
+        Configura la captura sin abrir el micrófono.
+
+        Parámetros:
+        - retencion (float): Segundos de audio que conserva el buffer circular.
+        - max_frases (int): Frases pendientes máximas; si se supera se descarta la más antigua.
+        - pre_roll (float): Segundos previos al inicio de la voz que se añaden a cada frase.
+        - duracion_minima (float): Frases con menos voz que esta se ignoran como ruido.
+        - duracion_maxima (float): Las frases se cortan al llegar a esta duración (ventana de Whisper).
+        """
+        self.retencion = retencion
+        self.pre_roll = pre_roll
+        self.duracion_minima = duracion_minima
+        self.duracion_maxima = duracion_maxima
+        self.frases = queue.Queue(maxsize=max_frases)
+        self.frases_descartadas = 0  # Frases perdidas por tener la cola llena
+        self.frases_ignoradas = 0  # Frases demasiado cortas
+        self.fragmentos_eco = 0  # Fragmentos descartados por coincidir con el TTS
+        self.buffer = None
+        self._formato = None  # (sample_rate, sample_width, chunk_duration)
+        self._listo = threading.Event()
+        self._detener = threading.Event()
+        self._hilos = []
+
+    def iniciar(self):
+        """Arranca los hilos de captura y segmentación y espera a que el micrófono esté abierto."""
+        if self._hilos:
+            return
+        self._detener.clear()
+        self._hilos = [
+            threading.Thread(target=self._bucle_captura, daemon=True),
+            threading.Thread(target=self._bucle_segmentador, daemon=True),
+        ]
+        for hilo in self._hilos:
+            hilo.start()
+        if not self._listo.wait(timeout=10):
+            self.detener()
+            raise RuntimeError("No se pudo abrir el micrófono para la captura continua.")
+
+    def detener(self):
+        """Detiene la captura y la segmentación."""
+        self._detener.set()
+        for hilo in self._hilos:
+            hilo.join(timeout=2)
+        self._hilos = []
+
+    def siguiente_frase(self, timeout=None):
+        """
+        Devuelve la siguiente frase completa (float32, 16 kHz) o None si no hay ninguna a tiempo.
+
+        Parámetros:
+        - timeout (float, opcional): Segundos máximos de espera.
+        """
+        try:
+            return self.frases.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def estado(self):
+        """Devuelve los contadores de la captura para diagnóstico."""
+        return {
+            "retencion": self.retencion,
+            "fragmentos_escritos": self.buffer.escritos if self.buffer else 0,
+            "fragmentos_perdidos": self.buffer.perdidos if self.buffer else 0,
+            "frases_pendientes": self.frases.qsize(),
+            "frases_descartadas": self.frases_descartadas,
+            "frases_ignoradas": self.frases_ignoradas,
+            "fragmentos_eco": self.fragmentos_eco,
+        }
+
+    def _bucle_captura(self):
+        """Lee el micrófono sin pausa y escribe cada fragmento en el buffer, marcando si sonaba el TTS."""
+        with ASR.microfono() as audio:
+            chunk_duration = audio.CHUNK / audio.SAMPLE_RATE
+            self._formato = (audio.SAMPLE_RATE, audio.SAMPLE_WIDTH, chunk_duration)
+            self.buffer = RingBuffer(max(1, int(self.retencion / chunk_duration)))
+            self._listo.set()
+
+            while not self._detener.is_set():
+                chunk = audio.stream.read(audio.CHUNK)
+                if not chunk:
+                    continue
+                self.buffer.escribir((chunk, TTS.en_reproduccion()))
+
+    def _bucle_segmentador(self):
+        """Detecta el inicio y el fin de cada frase en el buffer y encola las frases completas."""
+        self._listo.wait()
+        sample_rate, sample_width, chunk_duration = self._formato
+        pre_roll = collections.deque(maxlen=max(1, int(self.pre_roll / chunk_duration)))
+        posicion = 0
+        frames = []
+        hablando = False
+        silencio = 0.0
+        voz = 0.0
+
+        while not self._detener.is_set():
+            nuevos, posicion = self.buffer.leer_desde(posicion, timeout=0.5)
+
+            for chunk, eco in nuevos:
+                if eco:
+                    # PATO está hablando: se cierra la frase en curso con lo dicho antes del TTS
+                    self.fragmentos_eco += 1
+                    if hablando:
+                        self._encolar(b"".join(frames), voz, sample_rate, sample_width)
+                        hablando = False
+                    pre_roll.clear()
+                    continue
+
+                energia = ASR.energia_rms(chunk, sample_width)
+
+                if not hablando:
+                    # El suelo de ruido solo se estima con audio ambiente, no con voz ni con el TTS
+                    ASR.noise_tracker.actualizar(energia, chunk_duration)
+                    pre_roll.append(chunk)
+                    if energia > ASR.recognizer.energy_threshold:
+                        hablando = True
+                        frames = list(pre_roll)
+                        silencio = 0.0
+                        voz = chunk_duration
+                    continue
+
+                frames.append(chunk)
+                if energia > ASR.recognizer.energy_threshold:
+                    silencio = 0.0
+                    voz += chunk_duration
+                else:
+                    silencio += chunk_duration
+
+                fin_de_frase = silencio >= ASR.recognizer.pause_threshold
+                if fin_de_frase or len(frames) * chunk_duration >= self.duracion_maxima:
+                    self._encolar(b"".join(frames), voz, sample_rate, sample_width)
+                    hablando = False
+                    pre_roll.clear()
+
+    def _encolar(self, raw, voz, sample_rate, sample_width):
+        """Convierte una frase a float32 a 16 kHz y la encola, descartando la más antigua si no cabe."""
+        if voz < self.duracion_minima:
+            self.frases_ignoradas += 1
+            return
+
+        if ASR.DEBUG_AUDIO:
+            ASR.guardar_audio_debug(sr.AudioData(raw, sample_rate, sample_width))
+
+        frase = ASR.pcm_to_array(raw, sample_rate, sample_width)
+        while True:
+            try:
+                self.frases.put_nowait(frase)
+                return
+            except queue.Full:
+                try:
+                    self.frases.get_nowait()
+                    self.frases_descartadas += 1
+                    print("AudioCapture -> Cola de frases llena, se descarta la frase más antigua.")
+                except queue.Empty:
+                    pass
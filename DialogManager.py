@@ -3,8 +3,15 @@ DialogManager.py - Gestor de diálogos del asistente P.A.T.O.
 
 Este módulo gestiona la interacción del usuario con el asistente, incluyendo:
 - Procesamiento de comandos de voz y detección de intents.
+- Resolución léxica inmediata de frases de control, sin consultar al NLU.
+- Preclasificación de intents a partir de transcripciones parciales (modo streaming).
+- Ejecución concurrente de SER, NLU y construcción del contexto de tareas.
+- Análisis de emociones especulativo: se lanza junto al NLU solo si el mensaje no es
+  una frase de control conocida, y se descarta si el NLU devuelve un intent de control.
 - Integración con modelos NLU y LLM para generar respuestas.
-- Manejo de tareas pendientes y completadas.
+- Respuesta en streaming: cada frase del LLM se sintetiza mientras se genera el resto.
+- Manejo de tareas pendientes y completadas, enviando al LLM solo las relevantes
+  para cada mensaje dentro de un presupuesto de tokens.
 - Control de estado de conversación (pausa, inactividad, apagado).
 
 Clases:
@@ -15,16 +22,19 @@ Dependencias:
 - SER: Módulo para análisis de emociones en audio.
 - LLM: Modelo de lenguaje que genera respuestas en función del contexto.
 - TaskHandler: Manejador de tareas del usuario.
+- TaskContext: Selección y codificación compacta del contexto de tareas.
 """
 
 import json
 import re
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import TTS
-from SER import SER  # Análisis de emociones en voz
-from NLU import NLU  # Procesamiento del lenguaje natural
+from SER import SER, EmocionDiferida  # Análisis de emociones en voz
+from NLU import NLU, ControlPhraseMatcher, INTENTS_CONTROL  # Procesamiento del lenguaje natural
 from TaskHandler import TaskHandler  # Gestión de tareas
+from TaskContext import TaskContextBuilder  # Contexto de tareas para el LLM
 from LLM import LLM  # Modelo de lenguaje para generación de respuestas
 
 
@@ -38,6 +48,7 @@ class DialogManager:
     
     Métodos principales:
     - procesar_comando: Recibe y gestiona comandos del usuario.
+    - procesar_parcial: Preclasifica el intent a partir de una transcripción parcial.
     - procesar_intent: Determina el intent del usuario y responde apropiadamente.
     - generar_respuesta: Consulta el LLM y responde al usuario.
     - manejar_intent_control: Gestiona intents de control como pausa, reinicio o apagado.
@@ -46,17 +57,24 @@ class DialogManager:
 
     INACTIVITY_TIMEOUT = 60  # Tiempo límite en segundos para conversación activa
     PAUSE_TIMEOUT = 120  # Tiempo límite en segundos cuando la conversación está pausada
+    MENSAJE_ACCIONES_FALLIDAS = "Perdona, no he podido completar la acción. ¿Puedes repetírmelo?"
 
     def __init__(self, asistente):
         """Inicializa el gestor de diálogo con instancias de NLU, SER, LLM y TaskHandler."""
         self.asistente = asistente
-        self.nlu = NLU()
+        self.nlu = NLU(backend=getattr(asistente, "nlu_backend", "rasa"), bloquear=False)  # Rasa arranca mientras cargan SER y LLM
+        self.frases_control = ControlPhraseMatcher()  # Atajo léxico para los intents de control
         self.ser = SER()
         self.llm = LLM()
         self.task_handler = TaskHandler()
+        self.contexto_tareas = TaskContextBuilder(self.task_handler.task_manager)
         self.conversacion_activa = False
         self.pausa_activada = False  # Indica si la conversación está pausada
         self.ultima_actividad = time.time()  # Marca de tiempo de la última actividad
+        self.intent_anticipado = None  # Intent preclasificado desde una transcripción parcial
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="DM")  # SER y contexto en paralelo al NLU
+        self.llm_streaming = getattr(asistente, "llm_streaming", False)  # Hablar según genera el LLM
+        self.tts_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="TTS")  # Frases en orden
 
         # Palabras clave para activar y apagar el asistente
         self.wake_words = re.compile(r'\boye,?\s+pato\b', re.IGNORECASE)
@@ -71,16 +89,68 @@ class DialogManager:
         match = re.search(r'\boye,?\s+pato\b[,:]?\s(.*)', command, re.IGNORECASE)
         return match.group(1).strip() if match and match.group(1) else None
 
-    def procesar_comando(self, command: str, command_wav_file: str):
+    def mensaje_para_intent(self, command: str) -> str:
+        """Devuelve el mensaje que se enviaría al NLU para `command`, o None si se ignoraría."""
+        if self.conversacion_activa:
+            return command
+        if self.wake_words.search(command):
+            return self.extraer_comando(command) or "hola"
+        return None
+
+    def procesar_parcial(self, texto_parcial: str):
+        """
+        Preclasifica el intent de una transcripción parcial en segundo plano.
+
+        Si la frase final coincide con la parcial, `procesar_intent` reutiliza el
+        resultado y se ahorra la llamada al NLU tras el fin de la frase.
+        """
+        if self.shutdown_words.search(texto_parcial):
+            return
+
+        mensaje = self.mensaje_para_intent(texto_parcial)
+        if not mensaje or (self.intent_anticipado and self.intent_anticipado["mensaje"] == mensaje):
+            return
+
+        anticipado = {"mensaje": mensaje, "intent": None}
+        anticipado["hilo"] = threading.Thread(target=self.preclasificar_intent, args=(anticipado,), daemon=True)
+        self.intent_anticipado = anticipado
+        anticipado["hilo"].start()
+
+    def preclasificar_intent(self, anticipado: dict):
+        """Consulta el NLU para un mensaje anticipado y guarda el resultado."""
+        anticipado["intent"] = self.nlu.detectar_intent(anticipado["mensaje"])
+
+    def intent_frase_control(self, user_message: str):
+        """Devuelve el intent de control si el mensaje es una frase de control conocida, sin consultar al NLU."""
+        intent = self.frases_control.buscar(user_message)
+        if intent:
+            self.intent_anticipado = None
+            print(f"\nDM -> Frase de control reconocida sin NLU ({self.frases_control.estado()})")
+        return intent
+
+    def obtener_intent(self, user_message: str):
+        """
+        Devuelve el intent del mensaje por la vía más rápida disponible tras el atajo
+        léxico: el intent preclasificado o, si no, una consulta al NLU.
+        """
+        anticipado, self.intent_anticipado = self.intent_anticipado, None
+        if anticipado and anticipado["mensaje"] == user_message:
+            anticipado["hilo"].join()
+            return anticipado["intent"]
+        return self.nlu.detectar_intent(user_message)
+
+    def procesar_comando(self, command: str, command_audio):
         """Gestiona un comando detectado y controla el flujo de la conversación."""
         self.ultima_actividad = time.time()  # Actualizar marca de tiempo
-        emotion_detected = self.ser.detect_emotion(command_wav_file)
+        emocion = EmocionDiferida(self.ser, command_audio)
 
         if not command:
+            emocion.descartar("sin_texto")
             return
 
         if not self.conversacion_activa:
             if self.shutdown_words.search(command):
+                emocion.descartar("apagado")
                 self.shutdown()
                 return
 
@@ -88,43 +158,71 @@ class DialogManager:
                 self.conversacion_activa = True
                 TTS.quack(1)  # Señal de activación
                 comando_extraido = self.extraer_comando(command)
-                self.procesar_intent(comando_extraido if comando_extraido else "hola", emotion_detected)
+                self.procesar_intent(comando_extraido if comando_extraido else "hola", emocion)
                 return
 
         if self.conversacion_activa:
-            self.procesar_intent(command, emotion_detected)
+            self.procesar_intent(command, emocion)
+        else:
+            emocion.descartar("sin_activacion")
+
+    def procesar_intent(self, user_message: str, emocion: EmocionDiferida):
+        """
+        Detecta el intent del usuario y maneja la conversación en consecuencia.
 
-    def procesar_intent(self, user_message: str, emotion_detected: str):
-        """Detecta el intent del usuario y maneja la conversación en consecuencia."""
+        Las frases de control conocidas se resuelven sin NLU, SER ni contexto. Si
+        el mensaje no lo es y la conversación no está en pausa, la emoción y la
+        instantánea del contexto de tareas se lanzan de forma especulativa antes de
+        consultar al NLU, de modo que la espera es la del más lento de los tres y
+        no su suma. Si el NLU devuelve un intent de control se descartan.
+        """
         self.ultima_actividad = time.time()
 
-        intent = self.nlu.detectar_intent(user_message)
+        intent = self.intent_frase_control(user_message)
+        contexto_futuro = None
+        if intent is None:
+            if not self.pausa_activada:
+                emocion.lanzar(self.executor)
+                contexto_futuro = self.executor.submit(self.construir_contexto, user_message)
+            intent = self.obtener_intent(user_message)
         print(f"\nNLU -> Intent detectado: {intent}")
 
-        if intent in {
-            "despedir", "terminar_conversacion", "reiniciar_conversacion",
-            "pausar_conversacion", "continuar_conversacion", "mostrar_comandos"
-        }:
+        if intent in INTENTS_CONTROL:
+            emocion.descartar("intent_control")
+            if contexto_futuro:
+                contexto_futuro.cancel()
             self.manejar_intent_control(intent)
             return
 
-        if not self.pausa_activada:
-            self.generar_respuesta(user_message, emotion_detected)
+        if self.pausa_activada:
+            emocion.descartar("pausa")
+        else:
+            inicio = time.perf_counter()
+            emotion_detected = emocion.resultado()
+            contexto = contexto_futuro.result()
+            print(f"\nDM -> Espera por SER y contexto tras el NLU: {time.perf_counter() - inicio:.3f} s "
+                  f"(SER: {self.ser.estado()})")
+            self.generar_respuesta(user_message, emotion_detected, contexto)
 
-    def generar_respuesta(self, user_message: str, emotion_detected: str):
-        """Genera una respuesta basada en el contexto y la entrada del usuario."""
-		
+    def construir_contexto(self, user_message: str) -> str:
+        """Toma una instantánea de las tareas relevantes para el mensaje en JSON compacto para el LLM."""
         tareas_pendientes_txt = self.task_handler.task_manager.consultar_tareas(False)
-        tareas_completadas_txt = self.task_handler.task_manager.consultar_tareas_completadas(False)
-        
         print(f"\nDM -> Listas de tareas pendientes:\n{tareas_pendientes_txt}")
-        print(f"\nDM -> Listas de tareas completadas:\n{tareas_completadas_txt}")
-		
-        tareas_pendientes = self.task_handler.task_manager.consultar_tareas()
-        tareas_completadas = self.task_handler.task_manager.consultar_tareas_completadas()
 
-        contexto = {**tareas_pendientes, **tareas_completadas}
-        respuesta_json = self.llm.generar_respuesta(user_message, contexto=json.dumps(contexto), emotion_detected=emotion_detected)
+        contexto = self.contexto_tareas.construir(user_message)
+        print(f"\nDM -> Contexto de tareas: {self.contexto_tareas.ultimo}")
+        return contexto
+
+    def generar_respuesta(self, user_message: str, emotion_detected: str, contexto: str = None):
+        """Genera una respuesta basada en el contexto y la entrada del usuario."""
+        if contexto is None:
+            contexto = self.construir_contexto(user_message)
+
+        if self.llm_streaming:
+            self.generar_respuesta_en_streaming(user_message, emotion_detected, contexto)
+            return
+
+        respuesta_json = self.llm.generar_respuesta(user_message, contexto=contexto, emotion_detected=emotion_detected)
         respuesta_json = json.loads(respuesta_json)
 
         respuesta_final = (
@@ -139,6 +237,43 @@ class DialogManager:
         print(f"\nDM -> Listas de tareas completadas:\n{tareas_completadas_txt}")																						   
         # Responder al usuario
         TTS.speak(json.dumps(respuesta_final, ensure_ascii=False))
+        self.llm.guardar_turno(user_message, respuesta_final)  # Resumen en segundo plano, ya dicha la respuesta
+
+    def generar_respuesta_en_streaming(self, user_message: str, emotion_detected: str, contexto: str):
+        """
+        Genera la respuesta en streaming: cada frase de "response" se envía al TTS
+        en cuanto llega y las acciones se ejecutan cuando el LLM cierra el JSON.
+
+        Las frases se sintetizan en un hilo propio y en orden, de modo que el
+        análisis del resto de la generación no espera a la reproducción. Si la
+        respuesta ya se ha dicho pero sus acciones no se pudieron obtener, se avisa
+        al usuario de que no se ha hecho nada.
+        """
+        locuciones = []
+        respuesta_final = None
+        respuesta_json = json.loads(self.llm.generar_respuesta_en_streaming(
+            user_message, contexto=contexto, emotion_detected=emotion_detected,
+            on_frase=lambda frase: locuciones.append(self.tts_executor.submit(TTS.speak, frase)),
+        ))
+
+        if respuesta_json.get("tool_calls"):
+            respuesta = respuesta_json.get("response", "")
+            respuesta_final = self.task_handler.procesar_acciones(respuesta_json)
+            # Solo falta decir lo que las acciones añaden a la respuesta (o la sustituye, al deshacer)
+            extra = respuesta_final[len(respuesta):] if respuesta_final.startswith(respuesta) else respuesta_final
+            if extra.strip():
+                locuciones.append(self.tts_executor.submit(TTS.speak, extra.strip()))
+
+            print(f"\nDM -> Listas de tareas pendientes:\n{self.task_handler.task_manager.consultar_tareas(False)}")
+            print(f"\nDM -> Listas de tareas completadas:\n{self.task_handler.task_manager.consultar_tareas_completadas(False)}")
+        elif respuesta_json.get("acciones_fallidas"):
+            print("\nDM -> El LLM no generó acciones válidas para la respuesta ya dicha")
+            respuesta_final = f"{respuesta_json.get('response', '')} {self.MENSAJE_ACCIONES_FALLIDAS}".strip()
+            locuciones.append(self.tts_executor.submit(TTS.speak, self.MENSAJE_ACCIONES_FALLIDAS))
+
+        for locucion in locuciones:
+            locucion.result()  # No escuchar al usuario mientras PATO sigue hablando
+        self.llm.guardar_turno(user_message, respuesta_final or respuesta_json.get("response", ""))
 
     def manejar_intent_control(self, intent: str):
         """Maneja intents de control como pausar, continuar o apagar la conversación."""
@@ -186,6 +321,8 @@ class DialogManager:
     def shutdown(self):
         """Apaga correctamente el gestor de diálogo y finaliza la ejecución de PATO."""
         self.nlu.stop_rasa_nlu()
+        self.executor.shutdown(wait=False)
+        self.tts_executor.shutdown(wait=True)
         TTS.speak("Hasta luego.")
         TTS.quack(2)
         self.asistente.should_run = False
@@ -0,0 +1,271 @@
+"""
+IntentClassifier.py - Clasificador de intents en proceso entrenado desde `rasa/nlu.yml`
+
+Este módulo ofrece una alternativa local al servidor Rasa para los intents de
+control de PATO, que son pocos y tienen frases muy características:
+- Extrae n-gramas de caracteres (por palabra) y palabras completas del texto normalizado.
+- Pondera los rasgos con TF-IDF y normaliza cada vector a norma unitaria.
+- Entrena una regresión logística multinomial (softmax) con descenso de gradiente.
+- Rechaza las frases fuera de dominio: si pocas de sus palabras aparecen en los
+  datos de entrenamiento, la probabilidad del softmax no es fiable y se devuelve
+  confianza 0 (p. ej. "sigue lloviendo" no es "continuar_conversacion").
+- Serializa el modelo en JSON junto con la huella de los datos de entrenamiento,
+  de modo que se reentrena solo cuando cambia `nlu.yml`.
+
+Dependencias:
+- `yaml`: Para leer los ejemplos de entrenamiento en formato Rasa.
+- `hashlib` y `json`: Para la huella de los datos y la serialización del modelo.
+
+Clases:
+- `IntentClassifier`: Entrena, guarda, carga y aplica el clasificador.
+
+Funciones:
+- `normalizar(texto)`: Minúsculas, sin tildes ni signos de puntuación.
+- `cargar_ejemplos(nlu_path)`: Lee los pares (frase, intent) de un `nlu.yml`.
+
+Uso: `python IntentClassifier.py [nlu.yml] [modelo.json]` entrena y guarda el
+modelo sin arrancar PATO (el primer arranque con el backend "local" lo entrena
+si no existe, lo que lleva unos segundos).
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+import yaml
+
+
+def normalizar(texto):
+    """Convierte a minúsculas y elimina tildes y signos de puntuación."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]", " ", texto).split())
+
+
+def cargar_ejemplos(nlu_path):
+    """
+    Lee los ejemplos de entrenamiento de un archivo `nlu.yml` de Rasa.
+
+    Retorna:
+    - (list[tuple[str, str]]): Pares (frase, intent).
+    """
+    with open(nlu_path, encoding="utf-8") as f:
+        datos = yaml.safe_load(f)
+
+    ejemplos = []
+    for bloque in datos.get("nlu", []):
+        intent = bloque.get("intent")
+        if not intent:
+            continue
+        for linea in bloque.get("examples", "").splitlines():
+            frase = linea.strip()
+            if frase.startswith("- "):
+                frase = re.sub(r"\[([^\]]+)\]\([^)]*\)", r"\1", frase[2:])  # Quitar anotaciones de entidades
+                ejemplos.append((frase, intent))
+    return ejemplos
+
+
+def huella(nlu_path):
+    """Devuelve el hash SHA-1 del archivo de entrenamiento."""
+    with open(nlu_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class IntentClassifier:
+    """
+    Clasificador de intents por n-gramas de caracteres, TF-IDF y regresión logística.
+
+    `predecir(texto)` devuelve el intent más probable y su probabilidad, que es
+    comparable con la confianza de Rasa para aplicar el mismo umbral. Los
+    n-gramas de caracteres hacen que casi cualquier frase tenga rasgos
+    conocidos, así que el softmax puede dar confianzas altísimas a frases que no
+    se parecen a ningún ejemplo; por eso se exige además una cobertura mínima de
+    palabras conocidas.
+    """
+
+    VERSION = 1
+
+    def __init__(self, min_ngram=2, max_ngram=4, min_cobertura=0.55):
+        """
+        Crea un clasificador sin entrenar.
+
+        Parámetros:
+        - min_ngram (int): Longitud mínima de los n-gramas de caracteres.
+        - max_ngram (int): Longitud máxima de los n-gramas de caracteres.
+        - min_cobertura (float): Fracción mínima de palabras del texto vistas en el
+          entrenamiento; por debajo, la frase se considera fuera de dominio.
+        """
+        self.min_ngram = min_ngram
+        self.max_ngram = max_ngram
+        self.min_cobertura = min_cobertura
+        self.intents = []
+        self.idf = {}  # Rasgo -> peso IDF
+        self.pesos = {}  # Rasgo -> lista de pesos por intent
+        self.sesgos = []
+        self.huella = None
+
+    def rasgos(self, texto):
+        """Devuelve el recuento de rasgos (palabras y n-gramas de caracteres por palabra) del texto."""
+        recuento = {}
+        for palabra in normalizar(texto).split():
+            recuento["w:" + palabra] = recuento.get("w:" + palabra, 0) + 1
+            relleno = f" {palabra} "
+            for n in range(self.min_ngram, self.max_ngram + 1):
+                for i in range(len(relleno) - n + 1):
+                    rasgo = relleno[i:i + n]
+                    recuento[rasgo] = recuento.get(rasgo, 0) + 1
+        return recuento
+
+    def vectorizar(self, texto):
+        """Devuelve el vector TF-IDF disperso y normalizado del texto (solo rasgos conocidos)."""
+        vector = {
+            rasgo: (1 + math.log(tf)) * self.idf[rasgo]
+            for rasgo, tf in self.rasgos(texto).items() if rasgo in self.idf
+        }
+        norma = math.sqrt(sum(v * v for v in vector.values()))
+        return {rasgo: v / norma for rasgo, v in vector.items()} if norma else {}
+
+    def cobertura(self, texto):
+        """Fracción de las palabras del texto que aparecen en los datos de entrenamiento."""
+        palabras = normalizar(texto).split()
+        if not palabras:
+            return 0.0
+        return sum("w:" + palabra in self.idf for palabra in palabras) / len(palabras)
+
+    def probabilidades(self, vector):
+        """Devuelve la distribución softmax sobre los intents para un vector TF-IDF."""
+        logits = list(self.sesgos)
+        for rasgo, valor in vector.items():
+            for k, peso in enumerate(self.pesos[rasgo]):
+                logits[k] += peso * valor
+        maximo = max(logits)
+        exps = [math.exp(l - maximo) for l in logits]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def entrenar(self, ejemplos, epocas=300, tasa=8.0, l2=0.0, semilla=0):
+        """
+        Ajusta el vocabulario, el IDF y la regresión logística a los ejemplos.
+
+        Parámetros:
+        - ejemplos (list[tuple[str, str]]): Pares (frase, intent).
+        - epocas (int): Pasadas de descenso de gradiente estocástico.
+        - tasa (float): Tasa de aprendizaje inicial (decrece con las épocas).
+        - l2 (float): Regularización L2 de los pesos.
+        - semilla (int): Semilla del orden de los ejemplos, para que el entrenamiento sea reproducible.
+        """
+        self.intents = sorted({intent for _, intent in ejemplos})
+        indice = {intent: k for k, intent in enumerate(self.intents)}
+
+        documentos = [self.rasgos(frase) for frase, _ in ejemplos]
+        frecuencia = {}
+        for documento in documentos:
+            for rasgo in documento:
+                frecuencia[rasgo] = frecuencia.get(rasgo, 0) + 1
+        total = len(documentos)
+        self.idf = {rasgo: math.log((1 + total) / (1 + df)) + 1 for rasgo, df in frecuencia.items()}
+
+        self.pesos = {rasgo: [0.0] * len(self.intents) for rasgo in self.idf}
+        self.sesgos = [0.0] * len(self.intents)
+        datos = [(self.vectorizar(frase), indice[intent]) for frase, intent in ejemplos]
+
+        aleatorio = random.Random(semilla)
+        for epoca in range(epocas):
+            aleatorio.shuffle(datos)
+            paso = tasa / (1 + epoca * 0.05)
+            for vector, objetivo in datos:
+                probabilidades = self.probabilidades(vector)
+                gradiente = [p - (k == objetivo) for k, p in enumerate(probabilidades)]
+                for k, g in enumerate(gradiente):
+                    self.sesgos[k] -= paso * g
+                for rasgo, valor in vector.items():
+                    pesos = self.pesos[rasgo]
+                    for k, g in enumerate(gradiente):
+                        pesos[k] -= paso * (g * valor + l2 * pesos[k])
+        return self
+
+    def predecir(self, texto):
+        """
+        Clasifica un texto.
+
+        Retorna:
+        - (str, float): Intent más probable y su probabilidad, o (None, 0.0) si
+          el texto no contiene ningún rasgo conocido o queda fuera de dominio
+          (cobertura de palabras inferior a `min_cobertura`).
+        """
+        vector = self.vectorizar(texto)
+        if not vector or self.cobertura(texto) < self.min_cobertura:
+            return None, 0.0
+        probabilidades = self.probabilidades(vector)
+        mejor = max(range(len(probabilidades)), key=probabilidades.__getitem__)
+        return self.intents[mejor], probabilidades[mejor]
+
+    def guardar(self, ruta):
+        """Serializa el modelo en JSON."""
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": self.VERSION,
+                "huella": self.huella,
+                "min_ngram": self.min_ngram,
+                "max_ngram": self.max_ngram,
+                "min_cobertura": self.min_cobertura,
+                "intents": self.intents,
+                "idf": self.idf,
+                "pesos": {rasgo: [round(p, 6) for p in pesos] for rasgo, pesos in self.pesos.items()},
+                "sesgos": self.sesgos,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def cargar(cls, ruta):
+        """Carga un modelo serializado con `guardar`."""
+        with open(ruta, encoding="utf-8") as f:
+            datos = json.load(f)
+        if datos.get("version") != cls.VERSION:
+            raise ValueError(f"Versión de modelo no compatible en {ruta}.")
+
+        clasificador = cls(datos["min_ngram"], datos["max_ngram"], datos.get("min_cobertura", 0.55))
+        clasificador.huella = datos["huella"]
+        clasificador.intents = datos["intents"]
+        clasificador.idf = datos["idf"]
+        clasificador.pesos = datos["pesos"]
+        clasificador.sesgos = datos["sesgos"]
+        return clasificador
+
+    @classmethod
+    def desde_nlu(cls, nlu_path="rasa/nlu.yml", modelo_path="models/intent_classifier.json"):
+        """
+        Carga el modelo serializado o lo reentrena si `nlu.yml` ha cambiado.
+
+        Parámetros:
+        - nlu_path (str): Datos de entrenamiento en formato Rasa.
+        - modelo_path (str): Archivo donde se guarda el modelo entrenado.
+        """
+        huella_actual = huella(nlu_path)
+        if os.path.exists(modelo_path):
+            try:
+                clasificador = cls.cargar(modelo_path)
+                if clasificador.huella == huella_actual:
+                    return clasificador
+            except (ValueError, KeyError, json.JSONDecodeError) as e:
+                print(f"Modelo de intents no válido, se reentrena: {e}")
+
+        print(f"Entrenando el clasificador de intents desde {nlu_path} (nlu.yml nuevo o modificado; "
+              f"puede tardar unos segundos, o entrenarse antes con `python IntentClassifier.py`)...")
+        inicio = time.perf_counter()
+        clasificador = cls().entrenar(cargar_ejemplos(nlu_path))
+        clasificador.huella = huella_actual
+        clasificador.guardar(modelo_path)
+        print(f"Clasificador de intents entrenado en {time.perf_counter() - inicio:.1f} s y guardado en {modelo_path}")
+        return clasificador
+
+
+if __name__ == "__main__":
+    IntentClassifier.desde_nlu(*sys.argv[1:3])
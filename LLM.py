@@ -4,43 +4,66 @@ LLM.py - Módulo de interacción con el modelo de lenguaje (LLM)
 Este módulo gestiona la comunicación con el modelo de lenguaje (LLM) usando LangChain y Ollama.
 Se encarga de:
 - Generar respuestas estructuradas en JSON.
-- Validar la salida del modelo antes de procesarla.
-- Mantener un historial de conversación usando memoria optimizada.
+- Generar en streaming, entregando las frases de "response" según llegan para que el
+  TTS empiece antes de que termine la generación.
+- Restringir la decodificación con el JSON Schema de `LLMResponse` (salida estructurada de Ollama).
+- Validar la salida del modelo antes de procesarla, reparando localmente los defectos
+  habituales y reintentando solo como último recurso, con métricas de reintentos,
+  sus motivos y los reintentos evitados por las reparaciones.
+- Mantener un historial de conversación: una ventana de turnos recientes acotada en
+  tokens y un resumen de los anteriores que se actualiza en segundo plano.
 - Extraer y estructurar acciones de tareas desde la conversación.
+- Registrar los tokens del prompt de cada turno (los que informa Ollama o una estimación).
 
 Dependencias:
 - `langchain_ollama`: Para invocar el modelo de lenguaje.
-- `langchain.memory`: Para manejar memoria conversacional.
+- `threading`: Para resumir la memoria conversacional en un hilo propio.
 - `pydantic`: Para validar la estructura de las respuestas generadas.
+- `Tokens.contar_tokens`: Estimación de tokens compartida con el contexto de tareas.
 
 Clases:
 - `ToolCall`: Representa una acción de tareas generada por el LLM.
 - `LLMResponse`: Modelo estructurado para la respuesta completa del LLM.
+- `ResponseStreamParser`: Analizador incremental del JSON generado en streaming.
+- `MemoriaResumida`: Memoria conversacional con resumen asíncrono.
 - `LLM`: Maneja la comunicación con el modelo y la validación de respuestas.
 
 Métodos principales:
 - `generar_respuesta()`: Genera y valida una respuesta estructurada del LLM.
+- `generar_respuesta_en_streaming()`: Igual, pero emitiendo las frases de "response" según llegan.
 - `validar_respuesta()`: Verifica que la salida sea un JSON válido y estructurado.
+- `reparar_respuesta()`: Corrige defectos habituales de la salida antes de reintentar.
 - `get_formated_prompt()`: Construye el prompt con instrucciones detalladas.
+- `guardar_turno()`: Añade un turno a la memoria (tras haberlo dicho el TTS).
 - `borrar_memoria()`: Limpia la memoria conversacional.
 """
 
 from calendar import calendar
 from datetime import datetime, timedelta
 import json
+import time
+import re
+import threading
+from collections import deque
+from collections import Counter
+from typing import Literal
 from langchain_ollama import ChatOllama
-from langchain.memory import ConversationSummaryBufferMemory
 from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from pydantic import BaseModel, Field, ValidationError
+from Tokens import contar_tokens
+
+
+ACCIONES = Literal["añadir", "eliminar", "completar", "modificar", "deshacer", "consultar"]
+PRIORIDADES = Literal["baja", "normal", "alta", "urgente"]
 
 
 class ToolCall(BaseModel):
     """Estructura de las acciones que el LLM puede generar en su respuesta."""
-    action: str = Field(..., description="Acción a realizar: añadir, eliminar, completar, modificar, deshacer, consultar")
+    action: ACCIONES = Field(..., description="Acción a realizar: añadir, eliminar, completar, modificar, deshacer, consultar")
     task: str | None = Field(None, description="Nombre de la tarea (Opcional en 'deshacer')")
     new_task: str | None = Field(None, description="Nuevo nombre de la tarea (solo si se modifica)")
     due_date: str | None = Field(None, description="Fecha de vencimiento en formato YYYY-MM-DD (Opcional)")
-    priority: str = Field("normal", description="Prioridad: baja, normal, alta, urgente")
+    priority: PRIORIDADES = Field("normal", description="Prioridad: baja, normal, alta, urgente")
 
 
 class LLMResponse(BaseModel):
@@ -48,6 +71,349 @@ class LLMResponse(BaseModel):
     response: str = Field(..., description="Texto explicativo para el usuario")
     tool_calls: list[ToolCall] = Field([], description="Lista de acciones de tareas")
 
+    @classmethod
+    def esquema(cls):
+        """
+        JSON Schema de la respuesta para la salida estructurada de Ollama.
+
+        "tool_calls" se marca como obligatorio para que el modelo lo genere
+        siempre, aunque sea una lista vacía.
+        """
+        esquema = cls.model_json_schema()
+        esquema["required"] = ["response", "tool_calls"]
+        return esquema
+
+
+SINONIMOS_PRIORIDAD = {
+    "media": "normal", "medio": "normal", "medium": "normal", "normal": "normal",
+    "baja": "baja", "bajo": "baja", "low": "baja", "minima": "baja",
+    "alta": "alta", "alto": "alta", "high": "alta", "importante": "alta",
+    "urgente": "urgente", "urgent": "urgente", "maxima": "urgente", "muy alta": "urgente", "critica": "urgente",
+}
+VALORES_NULOS = {"", "null", "none", "nulo", "ninguno", "n/a"}
+
+
+def _sin_tildes(texto):
+    """Minúsculas y sin tildes, para comparar valores generados por el modelo."""
+    return texto.lower().strip().translate(str.maketrans("áéíóú", "aeiou"))
+
+
+def _comillas_simples_a_dobles(texto):
+    """Convierte las cadenas entre comillas simples en cadenas JSON, respetando las comillas dobles."""
+    resultado, i = [], 0
+    while i < len(texto):
+        caracter = texto[i]
+        if caracter == '"':
+            fin = i + 1
+            while fin < len(texto) and texto[fin] != '"':
+                fin += 2 if texto[fin] == "\\" else 1
+            resultado.append(texto[i:fin + 1])
+            i = fin + 1
+        elif caracter == "'":
+            fin = i + 1
+            while fin < len(texto) and texto[fin] != "'":
+                fin += 2 if texto[fin] == "\\" else 1
+            resultado.append(json.dumps(texto[i + 1:fin].replace("\\'", "'"), ensure_ascii=False))
+            i = fin + 1
+        else:
+            resultado.append(caracter)
+            i += 1
+    return "".join(resultado)
+
+
+def reparar_respuesta(respuesta_raw):
+    """
+    Intenta corregir localmente los defectos habituales de la salida del LLM.
+
+    Corrige: texto antes o después del objeto JSON, comillas simples, "tool_calls"
+    ausente o nulo, "tool_calls" como objeto en lugar de lista, valores "Null"
+    como cadena, prioridades desconocidas y acciones en mayúsculas.
+
+    Retorna:
+    - (dict | None, list[str]): Respuesta validada con `LLMResponse` (o None si no
+      se pudo reparar) y las reparaciones aplicadas.
+    """
+    reparaciones = []
+    inicio = respuesta_raw.find("{")
+    if inicio == -1:
+        return None, reparaciones
+    if respuesta_raw[:inicio].strip():
+        reparaciones.append("texto_previo")
+
+    texto = respuesta_raw[inicio:]
+    decoder = json.JSONDecoder()
+    try:
+        datos, fin = decoder.raw_decode(texto)
+    except json.JSONDecodeError:
+        try:
+            texto = _comillas_simples_a_dobles(texto)
+            datos, fin = decoder.raw_decode(texto)
+            reparaciones.append("comillas_simples")
+        except json.JSONDecodeError:
+            return None, reparaciones
+    if texto[fin:].strip():
+        reparaciones.append("texto_final")
+    if not isinstance(datos, dict):
+        return None, reparaciones
+
+    tool_calls = datos.get("tool_calls")
+    if tool_calls is None:
+        datos["tool_calls"] = []
+        reparaciones.append("sin_tool_calls")
+    elif isinstance(tool_calls, dict):
+        datos["tool_calls"] = [tool_calls]
+        reparaciones.append("tool_calls_objeto")
+
+    for tool_call in datos["tool_calls"] if isinstance(datos["tool_calls"], list) else []:
+        if not isinstance(tool_call, dict):
+            continue
+        for campo in ("task", "new_task", "due_date", "priority"):
+            valor = tool_call.get(campo)
+            if isinstance(valor, str) and _sin_tildes(valor) in VALORES_NULOS:
+                tool_call.pop(campo)
+                reparaciones.append("valor_null")
+        if isinstance(tool_call.get("action"), str) and tool_call["action"] != tool_call["action"].lower().strip():
+            tool_call["action"] = tool_call["action"].lower().strip()
+            reparaciones.append("accion_mayusculas")
+        if "priority" in tool_call:
+            prioridad = SINONIMOS_PRIORIDAD.get(_sin_tildes(str(tool_call["priority"])), "normal")
+            if prioridad != tool_call["priority"]:
+                tool_call["priority"] = prioridad
+                reparaciones.append("prioridad_desconocida")
+
+    try:
+        return LLMResponse(**datos).dict(), reparaciones
+    except (TypeError, ValidationError):
+        return None, reparaciones
+
+
+class ResponseStreamParser:
+    """
+    Analizador incremental de la respuesta JSON del LLM.
+
+    Recibe el texto a trozos (`alimentar`) y sigue la estructura del objeto sin
+    esperar a que termine: decodifica el valor de "response" según llega y
+    devuelve cada frase completa. Cuando el objeto de primer nivel se cierra,
+    `completo` pasa a True y `texto` contiene el JSON íntegro (sin el texto
+    que pudiera venir detrás).
+    """
+
+    FIN_FRASE = re.compile(r"[.!?…]+[\"')\]]*\s")
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": " ", "r": " ", "t": " "}
+
+    def __init__(self, longitud_minima=12):
+        """
+        Parámetros:
+        - longitud_minima (int): Caracteres mínimos de una frase; las más cortas se
+          unen a la siguiente para no trocear abreviaturas o enumeraciones.
+        """
+        self.longitud_minima = longitud_minima
+        self.texto = ""  # JSON recibido hasta ahora
+        self.completo = False
+        self.profundidad = 0
+        self.en_cadena = False
+        self.escape = None  # None, "" tras '\\' o los dígitos de un escape \\uXXXX
+        self.cadena = ""  # Cadena que se está leyendo
+        self.clave = None  # Última clave de primer nivel leída
+        self.esperando_valor = False
+        self.en_response = False
+        self.pendiente = ""  # Texto de "response" aún no emitido como frase
+        self.response = ""  # Valor completo de "response" decodificado
+
+    def alimentar(self, trozo):
+        """Procesa un trozo de texto y devuelve las frases de "response" que se han completado."""
+        frases = []
+        for caracter in trozo:
+            if self.completo:
+                break
+            self.texto += caracter
+            if self.en_cadena:
+                self._caracter_en_cadena(caracter, frases)
+            elif caracter == '"':
+                self.en_cadena = True
+                self.cadena = ""
+                self.en_response = self.profundidad == 1 and self.esperando_valor and self.clave == "response"
+            elif caracter in "{[":
+                self.profundidad += 1
+                self.esperando_valor = False
+            elif caracter in "}]":
+                self.profundidad -= 1
+                self.completo = self.profundidad == 0
+            elif caracter == ":" and self.profundidad == 1:
+                self.esperando_valor = True
+            elif caracter == "," and self.profundidad == 1:
+                self.esperando_valor = False
+        return frases
+
+    def finalizar(self):
+        """Devuelve el resto de "response" que no terminaba en fin de frase, si lo hay."""
+        resto, self.pendiente = self.pendiente.strip(), ""
+        return [resto] if resto else []
+
+    def _caracter_en_cadena(self, caracter, frases):
+        """Avanza la lectura de una cadena JSON, decodificando los escapes."""
+        if self.escape is not None:
+            if self.escape.startswith("u"):
+                self.escape += caracter
+                if len(self.escape) < 5:
+                    return
+                decodificado = chr(int(self.escape[1:], 16)) if re.fullmatch(r"u[0-9a-fA-F]{4}", self.escape) else ""
+            elif caracter == "u":
+                self.escape = "u"
+                return
+            else:
+                decodificado = self.ESCAPES.get(caracter, caracter)
+            self.escape = None
+            self._añadir(decodificado, frases)
+        elif caracter == "\\":
+            self.escape = ""
+        elif caracter == '"':
+            self.en_cadena = False
+            if self.profundidad == 1 and not self.esperando_valor:
+                self.clave = self.cadena
+            elif self.en_response:
+                self.en_response = False
+                frases.extend(self.finalizar())
+        else:
+            self._añadir(caracter, frases)
+
+    def _añadir(self, texto, frases):
+        """Añade texto decodificado a la cadena actual y emite frases si es "response"."""
+        self.cadena += texto
+        if not self.en_response:
+            return
+        self.response += texto
+        self.pendiente += texto
+        inicio = 0
+        for fin in self.FIN_FRASE.finditer(self.pendiente):
+            if fin.end() - inicio >= self.longitud_minima:
+                frases.append(self.pendiente[inicio:fin.end()].strip())
+                inicio = fin.end()
+        self.pendiente = self.pendiente[inicio:]
+
+
+class MemoriaResumida:
+    """
+    Memoria conversacional con resumen en segundo plano.
+
+    Los últimos turnos se conservan literalmente mientras quepan en
+    `max_token_limit`; los que salen de la ventana se resumen en un hilo propio
+    con `llm`. Leer el historial nunca espera a que termine un resumen: se usa
+    el último disponible y, literalmente, los turnos que aún no ha incorporado.
+    """
+
+    PROMPT_RESUMEN = (
+        "Actualiza el resumen de una conversación entre un usuario y PATO, un asistente de tareas, "
+        "añadiendo la información de los nuevos turnos. Conserva tareas, fechas, preferencias y datos "
+        "personales mencionados. Responde solo con el resumen, en español y en pocas frases.\n\n"
+        "Resumen actual:\n{resumen}\n\nNuevos turnos:\n{turnos}\n\nResumen actualizado:"
+    )
+
+    def __init__(self, llm, max_token_limit=1024):
+        """
+        Parámetros:
+        - llm: Modelo de chat de LangChain usado para resumir (salida de texto libre).
+        - max_token_limit (int): Tokens estimados máximos de la ventana de turnos recientes.
+        """
+        self.llm = llm
+        self.max_token_limit = max_token_limit
+        self.resumen = ""
+        self.recientes = deque()  # (usuario, asistente) literales
+        self.pendientes = []  # Turnos fuera de la ventana aún sin resumir
+        self.en_curso = []  # Turnos que se están resumiendo ahora mismo
+        self.resumenes = 0
+        self.tiempo_resumen = 0.0  # Segundos acumulados resumiendo (fuera del turno del usuario)
+        self._version = 0  # Se incrementa al borrar para descartar resúmenes en curso
+        self._cond = threading.Condition()
+        threading.Thread(target=self._bucle_resumen, daemon=True).start()
+
+    contar_tokens = staticmethod(contar_tokens)
+
+    def guardar_turno(self, usuario, asistente):
+        """Añade un turno; si la ventana se desborda, los más antiguos pasan a resumirse en segundo plano."""
+        with self._cond:
+            self.recientes.append((usuario, asistente))
+            tokens = sum(self.contar_tokens(u) + self.contar_tokens(a) for u, a in self.recientes)
+            while len(self.recientes) > 1 and tokens > self.max_token_limit:
+                u, a = self.recientes.popleft()
+                tokens -= self.contar_tokens(u) + self.contar_tokens(a)
+                self.pendientes.append((u, a))
+            if self.pendientes:
+                self._cond.notify()
+
+    @classmethod
+    def recortar(cls, texto, max_tokens):
+        """Conserva las últimas líneas de `texto` que caben en `max_tokens` tokens estimados."""
+        lineas = []
+        tokens = 0
+        for linea in reversed(texto.splitlines()):
+            tokens += cls.contar_tokens(linea)
+            if tokens > max_tokens:
+                break
+            lineas.append(linea)
+        return "\n".join(reversed(lineas))
+
+    def historial(self):
+        """
+        Devuelve el resumen y los turnos como texto para el prompt, sin esperar a ningún resumen.
+
+        Los turnos que han salido de la ventana pero aún no forman parte del
+        resumen (pendientes o en curso) se incluyen literalmente.
+        """
+        with self._cond:
+            resumen, recientes = self.resumen, self.en_curso + self.pendientes + list(self.recientes)
+        lineas = [f"Resumen: {resumen}"] if resumen else []
+        for usuario, asistente in recientes:
+            lineas += [f"Usuario: {usuario}", f"PATO: {asistente}"]
+        return "\n".join(lineas)
+
+    def borrar(self):
+        """Borra el resumen, los turnos y los resúmenes pendientes."""
+        with self._cond:
+            self.resumen = ""
+            self.recientes.clear()
+            self.pendientes = []
+            self.en_curso = []
+            self._version += 1
+
+    def estado(self):
+        """Devuelve el tamaño de la memoria y los resúmenes realizados."""
+        with self._cond:
+            return {
+                "turnos_recientes": len(self.recientes),
+                "turnos_pendientes": len(self.pendientes),
+                "turnos_en_curso": len(self.en_curso),
+                "tokens_resumen": self.contar_tokens(self.resumen) if self.resumen else 0,
+                "resumenes": self.resumenes,
+                "tiempo_resumen": self.tiempo_resumen,
+            }
+
+    def _bucle_resumen(self):
+        """Resume los turnos pendientes cada vez que los hay."""
+        while True:
+            with self._cond:
+                while not self.pendientes:
+                    self._cond.wait()
+                turnos, self.pendientes = self.pendientes, []
+                self.en_curso = turnos
+                resumen, version = self.resumen, self._version
+
+            texto_turnos = "\n".join(f"Usuario: {u}\nPATO: {a}" for u, a in turnos)
+            inicio = time.perf_counter()
+            try:
+                nuevo = self.llm.invoke(self.PROMPT_RESUMEN.format(resumen=resumen or "(vacío)", turnos=texto_turnos)).content.strip()
+            except Exception as e:
+                print(f"ERROR: No se pudo resumir la memoria: {e}")
+                # Conservar los turnos sin resumir, sin que el resumen crezca sin límite
+                nuevo = self.recortar(f"{resumen}\n{texto_turnos}".strip(), self.max_token_limit)
+
+            with self._cond:
+                if version == self._version:  # Descartar si la memoria se borró mientras tanto
+                    self.resumen = nuevo
+                    self.en_curso = []
+                    self.resumenes += 1
+                    self.tiempo_resumen += time.perf_counter() - inicio
+
 
 class LLM:
     """
@@ -68,33 +434,126 @@ class LLM:
             temperature=0.2,
             num_ctx=4096,
             repeat_penalty=1.2,
-            format='json',
+            format=LLMResponse.esquema(),  # Decodificación restringida al esquema de la respuesta
             max_tokens=256,
         )
 
-        self.memory = ConversationSummaryBufferMemory(
-            llm=self.llm,
-            memory_key="history",
-            max_token_limit=1024
-        )
+        # El resumen de la memoria es texto libre: no puede usar el modelo restringido al esquema
+        self.llm_resumen = ChatOllama(model=model_name, temperature=0.2, num_ctx=4096)
+
+        self.memory = MemoriaResumida(self.llm_resumen, max_token_limit=1024)
 
         self.max_reintentos = max_reintentos  # Número máximo de intentos si el JSON falla
+        self.generaciones = 0  # Llamadas a generar_respuesta_con_reintentos
+        self.reintentos = 0  # Generaciones repetidas por respuestas no válidas
+        self.motivos_reintento = Counter()  # Motivo -> número de reintentos
+        self.ultima_generacion = {}  # Intentos y motivos de la última llamada
+        self.reintentos_evitados = 0  # Respuestas no válidas recuperadas sin regenerar
+        self.reparaciones = Counter()  # Tipo de reparación -> veces aplicada
+        self.tokens_prompt = deque(maxlen=100)  # Tokens del prompt de los últimos turnos
 
     def generar_respuesta(self, mensaje_usuario, contexto="", emotion_detected="neutral"):
         """Genera una respuesta estructurada en JSON, con validación y reintentos en caso de error."""
         prompt = self.get_formated_prompt(mensaje_usuario, emotion_detected, contexto)
         return self.generar_respuesta_con_reintentos(prompt)
 
+    def generar_respuesta_en_streaming(self, mensaje_usuario, contexto="", emotion_detected="neutral", on_frase=None):
+        """
+        Genera la respuesta en streaming y llama a `on_frase(frase)` con cada frase de
+        "response" en cuanto se completa, antes de que el modelo genere "tool_calls".
+
+        Cuando el objeto JSON se cierra se valida completo. Si no es válido, se
+        regenera como en `generar_respuesta_con_reintentos` (la generación en
+        streaming cuenta como el primer intento):
+        - Si aún no se había emitido ninguna frase, se emite la "response" regenerada.
+        - Si ya se habían dicho frases, se conservan y de la regeneración solo se toman
+          las acciones. Si tampoco se obtienen, la respuesta incluye "acciones_fallidas"
+          para que el usuario sepa que no se ha hecho lo anunciado.
+
+        Retorna:
+        - (str): JSON validado, con el mismo formato que `generar_respuesta`.
+        """
+        on_frase = on_frase or (lambda frase: None)
+        prompt = self.get_formated_prompt(mensaje_usuario, emotion_detected, contexto)
+        parser = ResponseStreamParser()
+        inicio = time.perf_counter()
+        primera_frase = None
+        metadata = {}
+        self.generaciones += 1
+        self.ultima_generacion = {"intentos": 1, "motivos": []}
+
+        for trozo in self.llm.stream(prompt):
+            metadata = trozo.response_metadata or metadata
+            if parser.completo:
+                continue  # Solo falta el trozo final de Ollama, que trae `prompt_eval_count`
+            for frase in parser.alimentar(trozo.content):
+                if primera_frase is None:
+                    primera_frase = time.perf_counter() - inicio
+                    print(f"\nLLM -> Primera frase en {primera_frase:.2f} s")
+                on_frase(frase)
+
+        for frase in parser.finalizar():
+            primera_frase = primera_frase if primera_frase is not None else time.perf_counter() - inicio
+            on_frase(frase)
+        self.registrar_tokens_prompt(prompt, metadata)
+
+        respuesta_validada, motivo = self.validar_o_reparar(parser.texto)
+        if respuesta_validada:
+            print(f"\nLLM -> Respuesta en streaming completa en {time.perf_counter() - inicio:.2f} s")
+            if respuesta_validada.get("tool_calls"):
+                print(f"\nLLM -> Acciones:\n{json.dumps(respuesta_validada['tool_calls'], indent=4, ensure_ascii=False)}")
+            return json.dumps(respuesta_validada, ensure_ascii=False)
+
+        self.ultima_generacion["motivos"] = [motivo]
+        print(f"Respuesta en streaming no válida ({motivo}). Reintentando...")
+        regenerada = self.generar_con_reintentos(prompt, [motivo])
+
+        if primera_frase is None:
+            respuesta = self.respuesta_o_error(regenerada)
+            on_frase(json.loads(respuesta)["response"])
+            return respuesta
+
+        # Las frases ya se han dicho: se conserva el texto y se toman las acciones de la regeneración
+        if regenerada is None:
+            return json.dumps({"response": parser.response, "tool_calls": [], "acciones_fallidas": True}, ensure_ascii=False)
+        return json.dumps({"response": parser.response, "tool_calls": regenerada.get("tool_calls", [])}, ensure_ascii=False)
+
     def generar_respuesta_con_reintentos(self, prompt):
         """Genera una respuesta válida en JSON, reintentando en caso de error."""
-        for intento in range(self.max_reintentos):
-            respuesta_raw = self.llm.invoke(prompt).content.strip()
+        self.generaciones += 1
+        return self.respuesta_o_error(self.generar_con_reintentos(prompt))
+
+    @staticmethod
+    def respuesta_o_error(respuesta_validada):
+        """Serializa una respuesta validada o, si es None, la respuesta de error genérica."""
+        if respuesta_validada:
+            return json.dumps(respuesta_validada, ensure_ascii=False)
+        return json.dumps({
+            "response": "Lo siento, ocurrió un error al procesar la respuesta.",
+            "tool_calls": []
+        }, ensure_ascii=False)
 
-            if "tool_calls" not in respuesta_raw:
-                print("Advertencia: La respuesta no contiene 'tool_calls'. Reintentando...")
-                continue  # Reintentar
+    def generar_con_reintentos(self, prompt, motivos=None):
+        """
+        Invoca al LLM hasta obtener una respuesta válida o agotar `max_reintentos`.
+
+        Parámetros:
+        - motivos (list[str], opcional): Fallos de intentos ya realizados (p. ej. la
+          generación en streaming), que cuentan como intentos.
 
-            respuesta_validada = self.validar_respuesta(respuesta_raw)
+        Retorna:
+        - (dict | None): Respuesta validada, o None si se agotaron los intentos.
+        """
+        motivos = list(motivos or [])
+        for intento in range(len(motivos), self.max_reintentos):
+            if intento:
+                self.reintentos += 1
+                self.motivos_reintento[motivos[-1]] += 1
+            self.ultima_generacion = {"intentos": intento + 1, "motivos": motivos}
+            mensaje = self.llm.invoke(prompt)
+            self.registrar_tokens_prompt(prompt, mensaje.response_metadata)
+            respuesta_raw = mensaje.content.strip()
+            respuesta_validada, motivo = self.validar_o_reparar(respuesta_raw)
 
             if respuesta_validada:
                 respuesta_texto = respuesta_validada.get("response")
@@ -103,25 +562,76 @@ class LLM:
                 if respuesta_acciones:
                     print(f"\nLLM -> Acciones:\n{json.dumps(respuesta_acciones, indent=4, ensure_ascii=False)}")
 
-                return json.dumps(respuesta_validada, ensure_ascii=False)
+                return respuesta_validada
 
-            print(f"Intento {intento + 1}/{self.max_reintentos} fallido. Reintentando...")
+            motivos.append(motivo)
+            print(f"Intento {intento + 1}/{self.max_reintentos} fallido ({motivo}). Reintentando...")
 
         print("Se agotaron los intentos. No se pudo obtener un JSON válido.")
-        return json.dumps({
-            "response": "Lo siento, ocurrió un error al procesar la respuesta.",
-            "tool_calls": []
-        }, ensure_ascii=False)
+        return None
 
     def validar_respuesta(self, respuesta_raw):
         """Verifica que la respuesta del LLM sea un JSON válido y cumpla con la estructura esperada."""
+        return self.diagnosticar_respuesta(respuesta_raw)[0]
+
+    def validar_o_reparar(self, respuesta_raw):
+        """
+        Valida la respuesta y, si no es válida o no incluye "tool_calls", intenta
+        repararla localmente antes de que haga falta regenerarla.
+
+        Retorna:
+        - (dict | None, str | None): Respuesta validada y None, o None y el motivo
+          original del fallo.
+        """
+        respuesta_validada, motivo = self.diagnosticar_respuesta(respuesta_raw)
+        if respuesta_validada and "tool_calls" in respuesta_raw:
+            return respuesta_validada, None
+
+        reparada, reparaciones = reparar_respuesta(respuesta_raw)
+        if reparada:
+            self.reintentos_evitados += 1
+            self.reparaciones.update(reparaciones)
+            print(f"\nLLM -> Respuesta reparada sin regenerar: {', '.join(reparaciones) or 'sin cambios'}")
+            return reparada, None
+        return None, motivo or "sin_tool_calls"
+
+    def diagnosticar_respuesta(self, respuesta_raw):
+        """
+        Valida la respuesta del LLM e indica por qué no es válida.
+
+        Retorna:
+        - (dict | None, str | None): Respuesta validada y None, o None y el motivo
+          del fallo ("json_invalido" o "esquema_invalido").
+        """
         try:
             respuesta_json = json.loads(respuesta_raw)
-            respuesta_validada = LLMResponse(**respuesta_json)
-            return respuesta_validada.dict()
-        except (json.JSONDecodeError, ValidationError) as e:
+        except json.JSONDecodeError as e:
             print(f"ERROR: Validación del JSON fallida: {e}")
-            return None
+            return None, "json_invalido"
+        try:
+            return LLMResponse(**respuesta_json).dict(), None
+        except (TypeError, ValidationError) as e:
+            print(f"ERROR: Validación del JSON fallida: {e}")
+            return None, "esquema_invalido"
+
+    def registrar_tokens_prompt(self, prompt, metadata=None):
+        """Anota los tokens del prompt: los que informa Ollama o, si no los hay, una estimación."""
+        tokens = (metadata or {}).get("prompt_eval_count") or contar_tokens(prompt)
+        self.tokens_prompt.append(tokens)
+        print(f"\nLLM -> Tokens del prompt: {tokens}")
+
+    def estado(self):
+        """Devuelve las generaciones, los reintentos, sus motivos y los tokens del prompt por turno."""
+        return {
+            "generaciones": self.generaciones,
+            "reintentos": self.reintentos,
+            "motivos_reintento": dict(self.motivos_reintento),
+            "ultima_generacion": self.ultima_generacion,
+            "reintentos_evitados": self.reintentos_evitados,
+            "reparaciones": dict(self.reparaciones),
+            "tokens_prompt_ultimo": self.tokens_prompt[-1] if self.tokens_prompt else None,
+            "tokens_prompt_medio": sum(self.tokens_prompt) / len(self.tokens_prompt) if self.tokens_prompt else None,
+        }
         
                      
     def findDay(self, date):
@@ -141,7 +651,7 @@ class LLM:
     def get_formated_prompt(self, mensaje_usuario, emotion_detected, contexto):
         """Construye el prompt formateado con contexto y memoria conversacional."""
         
-        history_summary = self.memory.load_memory_variables({}).get("history", "")
+        history_summary = self.memory.historial()
 
         hoy = datetime.today()
         fecha_actual = hoy.strftime('%Y-%m-%d')
@@ -193,6 +703,8 @@ class LLM:
         
         11. La fecha de "due_date" por defecto para tareas nuevas es la de {fecha_mañana}.
 
+        12. El contexto solo incluye las tareas relevantes para el mensaje: cada tarea es una lista con las columnas indicadas en "formato", y "omitidas" indica cuántas tareas pendientes y completadas más existen sin mostrarse.
+
         Ejemplo 1 de salida:
         {{
             "response": "He añadido 'comprar leche' a tu lista.",
@@ -249,6 +761,15 @@ class LLM:
             dia=dia,
         ).to_string()
 
+    def guardar_turno(self, mensaje_usuario, respuesta):
+        """
+        Guarda un turno en la memoria conversacional.
+
+        Debe llamarse después de que el TTS haya dicho la respuesta: si hace falta
+        resumir, el resumen se hace en segundo plano sin retrasar el turno.
+        """
+        self.memory.guardar_turno(mensaje_usuario, respuesta)
+
     def borrar_memoria(self):
         """Borra la memoria conversacional almacenada."""
-        self.memory.clear()
+        self.memory.borrar()
@@ -3,31 +3,182 @@ NLU.py - Módulo de procesamiento del lenguaje natural (NLU) con Rasa
 
 Este módulo gestiona la comunicación con Rasa NLU, encargándose de:
 - Detectar intents en mensajes de texto.
-- Iniciar y detener el servidor Rasa si no está en ejecución.
+- Iniciar y detener el servidor Rasa si no está en ejecución, sin bloquear: el arranque
+  devuelve un `Future` que se resuelve cuando `/status` responde.
 - Seleccionar el modelo NLU más reciente disponible en el sistema.
+- Reutilizar una sesión HTTP persistente (keep-alive) y medir la latencia de cada consulta.
+- Cachear los intents por texto normalizado (LRU con caducidad), invalidando la caché
+  cuando cambia el modelo seleccionado. Mientras PATO está en marcha se comprueba
+  periódicamente si hay un modelo más reciente y, si lo hay, se carga y se vacía la caché.
+- Resolver localmente las frases de control exactas o casi exactas antes de consultar al NLU.
+- Alternativamente, clasificar en proceso con un modelo entrenado desde `rasa/nlu.yml`
+  (backend "local"), sin servidor Rasa.
 
 Dependencias:
-- `requests`: Para comunicarse con el servidor Rasa NLU.
+- `requests`: Para comunicarse con el servidor Rasa NLU mediante una sesión con pool de conexiones.
+- `asyncio`: Para la variante asíncrona de la detección de intents.
 - `subprocess`: Para iniciar el proceso de Rasa si no está en ejecución.
 - `psutil`: Para verificar si el proceso de Rasa sigue activo.
 - `glob`: Para buscar modelos NLU en la carpeta especificada.
+- `IntentClassifier`: Clasificador local para el backend "local".
 
 Clases:
 - NLU: Proporciona métodos para interactuar con Rasa NLU, incluyendo detección de intents 
   y gestión del servidor.
+- ControlPhraseMatcher: Reconocedor léxico de frases de control construido desde `rasa/nlu.yml`.
+- IntentCache: Caché LRU/TTL de intents y confianzas.
 
 Métodos principales:
 - `detectar_intent(mensaje)`: Envía un mensaje a Rasa y obtiene el intent detectado.
-- `start_rasa_nlu()`: Inicia el servidor Rasa si no está en ejecución.
+- `adetectar_intent(mensaje)`: Variante `async` de `detectar_intent` para pipelines asyncio.
+- `start_rasa_nlu()`: Inicia el servidor Rasa y devuelve el `Future` de disponibilidad.
+- `wait_for_rasa(timeout)`: Espera a que el servidor esté listo.
 - `stop_rasa_nlu()`: Detiene el servidor Rasa si está en ejecución.
+- `comprobar_modelo()`: Carga el modelo más reciente si ha cambiado desde el arranque.
 """
 
+import asyncio
+import collections
 import subprocess
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import os
 import glob
+import re
+import threading
+from concurrent.futures import Future
 from psutil import pid_exists
+from IntentClassifier import IntentClassifier, cargar_ejemplos, normalizar
+
+
+INTENTS_CONTROL = frozenset({
+    "despedir", "terminar_conversacion", "reiniciar_conversacion",
+    "pausar_conversacion", "continuar_conversacion", "mostrar_comandos"
+})
+
+
+class ControlPhraseMatcher:
+    """
+    Reconocedor léxico de frases de control.
+
+    Se construye con los ejemplos de los intents de control de `nlu.yml`. Una
+    frase coincide si, una vez normalizada y sin vocativos ni cortesías ("oye
+    pato", "pato", "por favor"), es idéntica a algún ejemplo. Los ejemplos que
+    aparecen en más de un intent se descartan para no resolver ambigüedades.
+    """
+
+    RELLENO = re.compile(r"^(?:(?:oye|hey|eh)\s+)?(?:pato\s+)?|(?:\s+pato)?(?:\s+por\s+favor)?(?:\s+pato)?$")
+
+    def __init__(self, nlu_path="rasa/nlu.yml", intents=INTENTS_CONTROL):
+        """
+        Parámetros:
+        - nlu_path (str): Datos de entrenamiento en formato Rasa.
+        - intents (set[str]): Intents que se pueden resolver léxicamente.
+        """
+        self.frases = {}
+        ambiguas = set()
+        for frase, intent in cargar_ejemplos(nlu_path):
+            if intent not in intents:
+                continue
+            clave = self.clave(frase)
+            if clave in self.frases and self.frases[clave] != intent:
+                ambiguas.add(clave)
+            self.frases[clave] = intent
+        for clave in ambiguas:
+            del self.frases[clave]
+        self.frases.pop("", None)
+        self.aciertos = 0
+        self.fallos = 0
+
+    def clave(self, texto):
+        """Normaliza un texto y elimina vocativos y cortesías de los extremos."""
+        return self.RELLENO.sub("", normalizar(texto))
+
+    def buscar(self, texto):
+        """Devuelve el intent de control de `texto` o None si no coincide con ninguna frase conocida."""
+        intent = self.frases.get(self.clave(texto))
+        if intent:
+            self.aciertos += 1
+        else:
+            self.fallos += 1
+        return intent
+
+    def estado(self):
+        """Devuelve los contadores de aciertos y fallos del reconocedor."""
+        total = self.aciertos + self.fallos
+        return {
+            "frases": len(self.frases),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / total if total else None,
+        }
+
+
+class IntentCache:
+    """
+    Caché LRU con caducidad de resultados del NLU.
+
+    Guarda (intent, confianza) por texto normalizado. Está ligada a un modelo:
+    al asignar un modelo distinto con `asignar_modelo` se vacía.
+    """
+
+    def __init__(self, capacidad=256, ttl=3600):
+        """
+        Parámetros:
+        - capacidad (int): Número máximo de entradas; se expulsa la usada hace más tiempo.
+        - ttl (float): Segundos que una entrada sigue siendo válida.
+        """
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self.modelo = None
+        self.entradas = collections.OrderedDict()  # clave -> (instante, intent, confianza)
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+        self._lock = threading.Lock()
+
+    def asignar_modelo(self, modelo):
+        """Asocia la caché a un modelo, vaciándola si es distinto del anterior."""
+        with self._lock:
+            if modelo != self.modelo:
+                if self.entradas:
+                    print(f"Modelo NLU cambiado, se vacía la caché de intents ({len(self.entradas)} entradas).")
+                    self.invalidaciones += 1
+                self.entradas.clear()
+                self.modelo = modelo
+
+    def obtener(self, clave):
+        """Devuelve (intent, confianza) si la clave está en caché y no ha caducado, o None."""
+        with self._lock:
+            entrada = self.entradas.get(clave)
+            if entrada and time.monotonic() - entrada[0] <= self.ttl:
+                self.entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1], entrada[2]
+            if entrada:
+                del self.entradas[clave]
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave, intent, confianza):
+        """Guarda un resultado, expulsando la entrada menos usada si la caché está llena."""
+        with self._lock:
+            self.entradas[clave] = (time.monotonic(), intent, confianza)
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.capacidad:
+                self.entradas.popitem(last=False)
+
+    def estado(self):
+        """Devuelve el tamaño de la caché, sus aciertos, fallos y tasa de aciertos."""
+        total = self.aciertos + self.fallos
+        return {
+            "entradas": len(self.entradas),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / total if total else None,
+            "invalidaciones": self.invalidaciones,
+        }
 
 
 class NLU:
@@ -39,43 +190,170 @@ class NLU:
     """
 
     port = '5005'  # Puerto en el que Rasa NLU está configurado para ejecutarse
+    TIMEOUT_CONEXION = 0.5  # Segundos para abrir la conexión (el servidor es local)
+    TIMEOUT_LECTURA = 5  # Segundos máximos de espera de la respuesta
+    TIMEOUT_ARRANQUE = 60  # Segundos máximos hasta que Rasa responde en /status
+    UMBRAL_CONFIANZA = 0.97  # Por debajo de esta confianza el intent se trata como "nlu_fallback"
+    INTERVALO_COMPROBACION_MODELO = 30  # Segundos mínimos entre comprobaciones de un modelo nuevo
+    BACKENDS = ("rasa", "local")
 
-    def __init__(self, server_url=f"http://localhost:{port}/model/parse", models_path="models/"):
-        """Inicializa el servicio de Rasa NLU verificando si está en ejecución o iniciándolo."""
+    def __init__(self, server_url=f"http://localhost:{port}/model/parse", models_path="models/",
+                 backend="rasa", nlu_path="rasa/nlu.yml", bloquear=True):
+        """
+        Inicializa el servicio de NLU.
+
+        Con el backend "rasa" verifica si el servidor está en ejecución o lo inicia.
+        Si `bloquear` es False no espera a que el servidor esté listo: la primera
+        consulta lo hará, y mientras tanto pueden cargarse otros módulos.
+        Con el backend "local" carga (o entrena, si `nlu_path` ha cambiado) el
+        clasificador en proceso guardado en `models_path`.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"backend debe ser uno de {self.BACKENDS}, no '{backend}'.")
+        self.backend = backend
         self.server_url = server_url
-        self.model_path = self.get_latest_nlu_model(models_path)
         self.rasa_process = None  # Proceso del servidor Rasa NLU
+        self.session = self.crear_sesion()
+        self.latencias = collections.deque(maxlen=500)  # Latencia de las últimas consultas en segundos
+        self.cache = IntentCache()  # Intents ya resueltos por texto normalizado
+        self.clasificador = None
+        self.rasa_listo = Future()  # Se resuelve con el tiempo de arranque cuando Rasa responde
+        self.salida_rasa = collections.deque(maxlen=50)  # Últimas líneas de stdout/stderr de Rasa
+        self._detener_sondeo = threading.Event()
+        self.models_path = models_path
+        self._ultima_comprobacion = time.monotonic()  # Última búsqueda de un modelo más reciente
+        self._carga_modelo = None  # Hilo que carga en Rasa un modelo nuevo
+        self._modelo_fallido = None  # Último modelo que Rasa no pudo cargar
+
+        if backend == "local":
+            self.model_path = os.path.join(models_path, "intent_classifier.json")
+            self.clasificador = IntentClassifier.desde_nlu(nlu_path, self.model_path)
+            self._mtime_modelo = os.path.getmtime(self.model_path)
+            self.cache.asignar_modelo(self.clasificador.huella)
+            print(f"Clasificador de intents local cargado: {len(self.clasificador.intents)} intents.")
+            self.rasa_listo.set_result(0.0)
+            return
 
+        self.model_path = self.get_latest_nlu_model(models_path)
         if not self.model_path:
             raise FileNotFoundError(f"No se encontró ningún modelo NLU en la carpeta {models_path}")
 
         if self.is_rasa_running():
             print("Servidor Rasa NLU ya está en ejecución.")
+            self.rasa_listo.set_result(0.0)
         else:
             print(f"Iniciando servidor Rasa NLU en {self.server_url}...")
             self.start_rasa_nlu()
+            if bloquear:
+                self.wait_for_rasa()
 
     def get_latest_nlu_model(self, models_path):
-        """Busca el modelo NLU más reciente en la carpeta de modelos."""
-        model_files = glob.glob(os.path.join(models_path, "nlu-*.tar.gz"))
+        """
+        Busca el modelo NLU más reciente en la carpeta de modelos.
 
-        if not model_files:
+        Si el modelo seleccionado es distinto del anterior, la caché de intents se vacía.
+        """
+        latest_model = self.buscar_ultimo_modelo(models_path)
+        if not latest_model:
             return None
-        latest_model = max(model_files, key=os.path.getctime)  # Seleccionar el modelo más reciente
         print(f"Modelo NLU seleccionado: {latest_model}")
+        self.cache.asignar_modelo(latest_model)
         return latest_model
 
-    def is_rasa_running(self):
+    @staticmethod
+    def buscar_ultimo_modelo(models_path):
+        """Devuelve la ruta del modelo `nlu-*.tar.gz` más reciente de la carpeta, o None."""
+        model_files = glob.glob(os.path.join(models_path, "nlu-*.tar.gz"))
+        return max(model_files, key=os.path.getctime) if model_files else None
+
+    def comprobar_modelo(self):
+        """
+        Busca un modelo más reciente, como mucho una vez cada `INTERVALO_COMPROBACION_MODELO` segundos.
+
+        - Backend "rasa": si aparece un `nlu-*.tar.gz` nuevo, se carga en el servidor
+          (`PUT /model`) en un hilo aparte; la caché se vacía cuando Rasa ya lo sirve.
+        - Backend "local": si el archivo del clasificador ha cambiado (p. ej. reentrenado
+          con `python IntentClassifier.py`), se recarga y se vacía la caché.
+        """
+        ahora = time.monotonic()
+        if ahora - self._ultima_comprobacion < self.INTERVALO_COMPROBACION_MODELO:
+            return
+        self._ultima_comprobacion = ahora
+
+        if self.clasificador:
+            try:
+                mtime = os.path.getmtime(self.model_path)
+                if mtime != self._mtime_modelo:
+                    self.clasificador = IntentClassifier.cargar(self.model_path)
+                    self._mtime_modelo = mtime
+                    print(f"Clasificador de intents recargado desde {self.model_path}.")
+                    self.cache.asignar_modelo(self.clasificador.huella)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"ERROR: No se pudo recargar el clasificador de intents: {e}")
+            return
+
+        ultimo = self.buscar_ultimo_modelo(self.models_path)
+        if not ultimo or ultimo in (self.model_path, self._modelo_fallido):
+            return
+        if self._carga_modelo and self._carga_modelo.is_alive():
+            return
+        self._carga_modelo = threading.Thread(target=self._cargar_modelo_rasa, args=(ultimo,), daemon=True)
+        self._carga_modelo.start()
+
+    def _cargar_modelo_rasa(self, modelo):
+        """Pide al servidor Rasa que sirva `modelo` y, si lo consigue, asocia la caché al nuevo modelo."""
+        print(f"Nuevo modelo NLU detectado, cargándolo en Rasa: {modelo}")
+        try:
+            self.wait_for_rasa(self.TIMEOUT_ARRANQUE)
+            response = self.session.put(f"http://localhost:{self.port}/model", json={"model_file": modelo},
+                                        timeout=(self.TIMEOUT_CONEXION, self.TIMEOUT_ARRANQUE))
+            response.raise_for_status()
+        except (requests.RequestException, TimeoutError) as e:
+            print(f"ERROR: Rasa no pudo cargar el modelo NLU {modelo}: {e}")
+            self._modelo_fallido = modelo
+            return
+        self.model_path = modelo
+        self.cache.asignar_modelo(modelo)
+        print(f"Modelo NLU seleccionado: {modelo}")
+
+    @staticmethod
+    def crear_sesion(conexiones=4):
+        """
+        Crea una sesión HTTP de larga duración para hablar con Rasa.
+
+        La sesión mantiene las conexiones abiertas (keep-alive), de modo que cada
+        consulta reutiliza el socket en lugar de pagar de nuevo el establecimiento
+        de la conexión TCP. `conexiones` limita las consultas simultáneas (p. ej.
+        la preclasificación de parciales en paralelo con la frase final).
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=conexiones, max_retries=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def is_rasa_running(self, verbose=True):
         """Verifica si el servidor de Rasa NLU está en ejecución."""
         try:
-            print("Probando conexión con el servidor Rasa...")
-            response = requests.get(f"http://localhost:{self.port}/status", timeout=5)
+            if verbose:
+                print("Probando conexión con el servidor Rasa...")
+            response = self.session.get(f"http://localhost:{self.port}/status",
+                                        timeout=(self.TIMEOUT_CONEXION, self.TIMEOUT_LECTURA))
             return response.status_code == 200
-        except requests.ConnectionError:
+        except (requests.ConnectionError, requests.Timeout):
             return False
 
     def start_rasa_nlu(self):
-        """Inicia el servidor Rasa con el modelo NLU más reciente."""
+        """
+        Inicia el servidor Rasa con el modelo NLU más reciente sin esperar a que esté listo.
+
+        La salida del proceso se consume en hilos propios (si nadie lee las
+        tuberías y se llenan, Rasa se bloquea) y otro hilo sondea `/status`.
+
+        Retorna:
+        - (Future): Se resuelve con los segundos que tardó Rasa en estar listo, o
+          con `TimeoutError` si no arranca a tiempo o el proceso termina.
+        """
         conda_exe = r"C:\Users\acamo\anaconda3\Scripts\conda.exe"  # Ajusta según tu ruta
 
         self.rasa_process = subprocess.Popen(
@@ -84,56 +362,129 @@ class NLU:
             shell=False  # shell=False se recomienda para evitar problemas de seguridad
         )
 
-        self.wait_for_rasa()
+        for tuberia in (self.rasa_process.stdout, self.rasa_process.stderr):
+            threading.Thread(target=self._drenar_salida, args=(tuberia,), daemon=True).start()
+        threading.Thread(target=self._sondear_rasa, args=(time.perf_counter(),), daemon=True).start()
+        return self.rasa_listo
 
-    def wait_for_rasa(self, timeout=20):
-        """Espera hasta que el servidor Rasa NLU esté listo o agota el tiempo de espera."""
-        print("Esperando a que el servidor Rasa NLU se inicie...")
-        print("Esperando al servidor")
-        time.sleep(10)  # Esperar unos segundos para que arranque														 
-        start_time = time.time()
+    def _drenar_salida(self, tuberia):
+        """Lee una tubería del proceso de Rasa hasta que se cierra, guardando las últimas líneas."""
+        for linea in iter(tuberia.readline, ""):
+            self.salida_rasa.append(linea.rstrip())
+        tuberia.close()
 
-        while time.time() - start_time < timeout:
-            if self.is_rasa_running():
-                print("Servidor Rasa NLU está listo.")
+    def _sondear_rasa(self, inicio, espera_inicial=0.25, espera_maxima=2.0):
+        """Sondea `/status` con espera exponencial y resuelve `rasa_listo`."""
+        espera = espera_inicial
+        while time.perf_counter() - inicio < self.TIMEOUT_ARRANQUE and not self._detener_sondeo.is_set():
+            if self.rasa_process.poll() is not None:
+                ultimas = "\n".join(list(self.salida_rasa)[-5:])
+                self.rasa_listo.set_exception(TimeoutError(
+                    f"El proceso de Rasa terminó con código {self.rasa_process.returncode}:\n{ultimas}"))
+                return
+            if self.is_rasa_running(verbose=False):
+                tiempo = time.perf_counter() - inicio
+                print(f"Servidor Rasa NLU está listo en {tiempo:.1f} s.")
+                self.rasa_listo.set_result(tiempo)
                 return
-            time.sleep(5)  # Verificar cada 5 segundos
+            self._detener_sondeo.wait(espera)
+            espera = min(espera * 2, espera_maxima)
 
-        raise TimeoutError("Tiempo de espera agotado. Rasa NLU no inició correctamente.")
+        self.rasa_listo.set_exception(TimeoutError("Tiempo de espera agotado. Rasa NLU no inició correctamente."))
+
+    def wait_for_rasa(self, timeout=None):
+        """
+        Espera hasta que el servidor Rasa NLU esté listo o agota el tiempo de espera.
+
+        Retorna los segundos que tardó en arrancar; lanza `TimeoutError` si no arranca.
+        """
+        if not self.rasa_listo.done():
+            print("Esperando a que el servidor Rasa NLU se inicie...")
+        return self.rasa_listo.result(timeout)
 
     def stop_rasa_nlu(self):
         """Detiene el servidor Rasa si está en ejecución."""
+        self._detener_sondeo.set()
         if self.rasa_process and pid_exists(self.rasa_process.pid):
             print("Deteniendo el servidor Rasa NLU...")
             self.rasa_process.terminate()
             self.rasa_process.wait()
             print("Servidor Rasa NLU detenido.")
+        self.session.close()
+
+    def clasificar(self, mensaje):
+        """
+        Obtiene el intent y la confianza del backend configurado, sin aplicar el umbral.
+
+        Retorna:
+        - (str, float): Intent detectado y su confianza.
+
+        Lanza `requests.RequestException` si falla la consulta a Rasa.
+        """
+        inicio = time.perf_counter()
+        if self.clasificador:
+            intent, confidence = self.clasificador.predecir(mensaje)
+            self.latencias.append(time.perf_counter() - inicio)
+            return intent or "nlu_fallback", confidence
+
+        response = self.session.post(self.server_url, json={"text": mensaje},
+                                     timeout=(self.TIMEOUT_CONEXION, self.TIMEOUT_LECTURA))
+        self.latencias.append(time.perf_counter() - inicio)
+        response.raise_for_status()  # Lanza un error si la solicitud falla
+
+        resultado = response.json()
+        return resultado.get("intent", {}).get("name", "desconocido"), resultado.get("intent", {}).get("confidence", 0)
 
     def detectar_intent(self, mensaje):
         """
-        Envía un mensaje a Rasa NLU y obtiene el intent detectado.
+        Obtiene el intent detectado para un mensaje.
 
         Parámetros:
-        - mensaje (str): Texto que se enviará a Rasa NLU para análisis.
+        - mensaje (str): Texto que se enviará al NLU para análisis.
 
         Retorna:
-        - intent (str): Nombre del intent detectado.
+        - intent (str): Nombre del intent detectado, "nlu_fallback" si la confianza
+          no supera `UMBRAL_CONFIANZA` o None si el servidor Rasa no responde.
         """
-        payload = {"text": mensaje}
-
+        clave = normalizar(mensaje)
+        self.comprobar_modelo()
         try:
-            with requests.Session() as session:
-                response = session.post(self.server_url, json=payload, timeout=10)
-            response.raise_for_status()  # Lanza un error si la solicitud falla
-
-            resultado = response.json()
-            intent = resultado.get("intent", {}).get("name", "desconocido")
-            confidence = resultado.get("intent", {}).get("confidence", 0)
+            resultado = self.cache.obtener(clave)
+            if resultado is None:
+                self.wait_for_rasa(self.TIMEOUT_ARRANQUE)
+                resultado = self.clasificar(mensaje)
+                self.cache.guardar(clave, *resultado)
+            intent, confidence = resultado
             print(f"intent: {intent}, confianza: {confidence}")
-            if confidence <= 0.97:
+            if confidence <= self.UMBRAL_CONFIANZA:
                 return "nlu_fallback"
             return intent
 
-        except requests.RequestException as e:
+        except (requests.RequestException, TimeoutError) as e:
             print(f"Error en la API de Rasa: {e}")
             return None
+
+    async def adetectar_intent(self, mensaje):
+        """
+        Variante asíncrona de `detectar_intent`.
+
+        Ejecuta la consulta en un hilo del executor por defecto de asyncio,
+        reutilizando la misma sesión con pool de conexiones.
+        """
+        return await asyncio.to_thread(self.detectar_intent, mensaje)
+
+    def estado(self):
+        """Devuelve las consultas al backend, su latencia media, p50 y p95, el tiempo de arranque de Rasa y el estado de la caché."""
+        latencias = sorted(self.latencias)
+        arranque = self.rasa_listo.result() if self.rasa_listo.done() and not self.rasa_listo.exception() else None
+        if not latencias:
+            return {"consultas": 0, "latencia_media": None, "latencia_p50": None, "latencia_p95": None,
+                    "cache": self.cache.estado(), "arranque_rasa": arranque}
+        return {
+            "cache": self.cache.estado(),
+            "arranque_rasa": arranque,
+            "consultas": len(latencias),
+            "latencia_media": sum(latencias) / len(latencias),
+            "latencia_p50": latencias[len(latencias) // 2],
+            "latencia_p95": latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))],
+        }
@@ -5,27 +5,44 @@ Este módulo utiliza el modelo `iic/emotion2vec_plus_base` de funasr para analiz
 las emociones presentes en archivos de audio.
 
 Funcionalidad:
-- Carga el modelo de SER (Speech Emotion Recognition).
-- Procesa un archivo de audio y detecta la emoción predominante.
+- Carga el modelo de SER (Speech Emotion Recognition), en precisión completa o
+  cuantizado dinámicamente a int8 para inferencia en CPU.
+- Procesa un archivo de audio o un buffer en memoria y detecta la emoción predominante.
+  Los resultados solo se escriben en disco en modo depuración (`PATO_DEBUG_AUDIO=1`).
+- Analiza lotes de audios sin escribir resultados en disco (análisis offline).
 - Maneja errores si el archivo no existe o si el modelo falla.
+- Evaluación diferida de la emoción: solo se calcula si el LLM la va a usar.
 
 Dependencias:
 - `funasr`: Para cargar el modelo de reconocimiento de emociones.
-- `os`: Para verificar la existencia del archivo de audio.
+- `torch`: Para la cuantización dinámica del backend int8 (importación diferida).
+- `os`: Para verificar la existencia del archivo de audio y leer `PATO_DEBUG_AUDIO`.
+- `time`: Para medir el tiempo de inferencia de cada lote.
+- `numpy`: Para aceptar audio en memoria (float32, 16 kHz).
+- `threading` y `collections`: Para la caché de la emoción diferida y sus contadores.
 
 Clases:
 - `SER`: Maneja la detección de emociones en archivos de audio.
+- `EmocionDiferida`: Emoción de un audio calculada bajo demanda y cacheada.
 
 Métodos principales:
-- `detect_emotion(wav_file)`: Analiza un archivo de audio y devuelve la emoción detectada.
+- `detect_emotion(audio)`: Analiza un audio (ruta o array) y devuelve la emoción detectada.
+- `detect_emotions(inputs, batch_size)`: Analiza una lista de audios por lotes y devuelve etiquetas, puntuaciones y tiempos.
 """
 
 import warnings
 warnings.filterwarnings("ignore")  # Ignorar advertencias innecesarias
 
 import os
+import time
+import threading
+import collections
+from concurrent.futures import Future
+import numpy as np
 from funasr import AutoModel
 
+DEBUG_AUDIO = os.environ.get("PATO_DEBUG_AUDIO", "0") == "1"  # Mismo interruptor que ASR
+
 
 class SER:
     """
@@ -34,18 +51,30 @@ class SER:
     Utiliza el modelo `iic/emotion2vec_plus_base` de funasr.
     """
 
-    def __init__(self, model_id="iic/emotion2vec_plus_base", output_dir="./Resources", emotions=None):
+    BACKENDS = ("funasr", "int8")
+
+    def __init__(self, model_id="iic/emotion2vec_plus_base", output_dir="./Resources", emotions=None, backend="funasr"):
         """
         Inicializa el modelo de reconocimiento de emociones.
 
         Parámetros:
         - model_id (str): Identificador del modelo a utilizar.
-        - output_dir (str): Directorio donde se guardarán los resultados.
+        - backend (str): "funasr" para el modelo en precisión completa en el dispositivo
+          por defecto, o "int8" para el mismo modelo en CPU con las capas lineales
+          cuantizadas dinámicamente a int8.
+        - output_dir (str): Directorio donde se guardan los resultados de `detect_emotion`
+          cuando `PATO_DEBUG_AUDIO=1`; en uso normal no se escribe nada en disco.
         - emotions (dict): Diccionario de mapeo entre índices y emociones.
 
         Si `emotions` no se proporciona, se usa un conjunto de emociones por defecto.
         """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"backend debe ser uno de {self.BACKENDS}, no '{backend}'.")
+        self.backend = backend
         self.output_dir = output_dir
+        self.inferencias = 0  # Inferencias de SER ejecutadas
+        self.evitadas = collections.Counter()  # Inferencias ahorradas por motivo
+        self.desperdiciadas = collections.Counter()  # Inferencias especulativas ya en marcha al descartarse
 
         # Emociones por defecto
         self.emotions = emotions or {
@@ -54,34 +83,56 @@ class SER:
         }
     
         try:
-            self.model = AutoModel(model=model_id, disable_update=True, log_level="CRITICAL")
-            print("Modelo de SER cargado correctamente.")
+            if backend == "int8":
+                self.model = AutoModel(model=model_id, device="cpu", disable_update=True, log_level="CRITICAL")
+                self.model.model = self.cuantizar(self.model.model)
+            else:
+                self.model = AutoModel(model=model_id, disable_update=True, log_level="CRITICAL")
+            print(f"Modelo de SER cargado correctamente (backend: {backend}).")
         except Exception as e:
             print(f"ERROR: No se pudo cargar el modelo SER: {e}")
             self.model = None
 
-    def detect_emotion(self, wav_file):
+    @staticmethod
+    def cuantizar(modelo):
+        """Devuelve una copia del modelo torch con las capas lineales cuantizadas dinámicamente a int8."""
+        import torch  # Importación diferida: solo la necesita el backend int8
+        return torch.quantization.quantize_dynamic(modelo.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+    def _validar_audio(self, audio):
+        """Devuelve un mensaje de error si el audio no se puede analizar, o None si es válido."""
+        if isinstance(audio, np.ndarray):
+            return "El audio recibido está vacío." if audio.size == 0 else None
+        if audio is None or not os.path.exists(audio):
+            return f"El archivo {audio} no existe."
+        return None
+
+    def detect_emotion(self, audio):
         """
-        Detecta la emoción presente en el archivo de audio proporcionado.
+        Detecta la emoción presente en el audio proporcionado.
 
         Parámetros:
-        - wav_file (str): Ruta del archivo de audio a analizar.
+        - audio (str | np.ndarray): Ruta del archivo de audio o buffer float32 a 16 kHz.
 
         Retorna:
         - (str): Emoción detectada o "unknown" si no se pudo determinar.
         """
-        if not os.path.exists(wav_file):
-            print(f"ERROR: El archivo {wav_file} no existe.")
+        error = self._validar_audio(audio)
+        if error:
+            print(f"ERROR: {error}")
             return "unknown"
 
         if self.model is None:
             print("ERROR: El modelo SER no está disponible.")
             return "unknown"
 
+        self.inferencias += 1
         try:
             # Procesar el archivo de audio y obtener las emociones detectadas
+            # En el camino de cada turno no se escribe en disco salvo al depurar
+            salida = {"output_dir": self.output_dir} if DEBUG_AUDIO else {}
             result = self.model.generate(
-                wav_file, output_dir=self.output_dir,
+                audio, **salida,
                 granularity="utterance", extract_embedding=False, disable_pbar=True
             )
 
@@ -101,3 +152,120 @@ class SER:
         except Exception as e:
             print(f"ERROR: Error al detectar la emoción: {e}")
             return "unknown"
+
+    def detect_emotions(self, inputs, batch_size=8):
+        """
+        Detecta la emoción de varios audios procesándolos por lotes.
+
+        Nunca escribe en `output_dir`, ni siquiera en modo depuración. Los
+        audios que no se pueden analizar devuelven "unknown" sin puntuaciones
+        y no interrumpen el resto del lote.
+
+        Parámetros:
+        - inputs (list[str | np.ndarray]): Rutas de archivos o buffers float32 a 16 kHz.
+        - batch_size (int): Número de audios por llamada al modelo.
+
+        Retorna:
+        - (list[dict]): Un resultado por entrada, en el mismo orden, con las claves
+          "emocion", "scores" (puntuación de cada emoción en el orden de `emotions`),
+          "tiempo" (segundos de inferencia atribuidos al audio) y "error".
+        """
+        resultados = []
+        for i in range(0, len(inputs), batch_size):
+            lote = inputs[i:i + batch_size]
+            resultados_lote = [{"emocion": "unknown", "scores": None, "tiempo": 0.0, "error": self._validar_audio(audio)}
+                               for audio in lote]
+            if self.model is None:
+                for resultado in resultados_lote:
+                    resultado["error"] = resultado["error"] or "El modelo SER no está disponible."
+                resultados.extend(resultados_lote)
+                continue
+
+            validos = [j for j, resultado in enumerate(resultados_lote) if resultado["error"] is None]
+            if validos:
+                try:
+                    inicio = time.perf_counter()
+                    salida = self.model.generate(
+                        [lote[j] for j in validos], batch_size=len(validos),
+                        granularity="utterance", extract_embedding=False, disable_pbar=True
+                    )
+                    tiempo = (time.perf_counter() - inicio) / len(validos)
+                    self.inferencias += len(validos)
+
+                    for j, item in zip(validos, salida):
+                        scores = [float(score) for score in item.get("scores") or []]
+                        resultados_lote[j]["tiempo"] = tiempo
+                        if not scores:
+                            resultados_lote[j]["error"] = "No se obtuvieron resultados del modelo."
+                            continue
+                        resultados_lote[j]["scores"] = scores
+                        resultados_lote[j]["emocion"] = self.emotions.get(scores.index(max(scores)), "unknown")
+                except Exception as e:
+                    for j in validos:
+                        resultados_lote[j]["error"] = f"Error al detectar la emoción: {e}"
+
+            resultados.extend(resultados_lote)
+        return resultados
+
+    def estado(self):
+        """Devuelve los contadores de inferencias ejecutadas, evitadas y desperdiciadas."""
+        return {
+            "inferencias": self.inferencias,
+            "evitadas": sum(self.evitadas.values()),
+            "motivos": dict(self.evitadas),
+            "desperdiciadas": dict(self.desperdiciadas),
+        }
+
+
+class EmocionDiferida:
+    """
+    Emoción de un audio que solo se calcula si alguien la necesita.
+
+    El resultado se cachea, por lo que `lanzar()` y `resultado()` pueden
+    llamarse varias veces sin repetir la inferencia. Si el audio se descarta
+    sin haberse analizado, se anota como inferencia evitada en el `SER`.
+    """
+
+    def __init__(self, ser, audio):
+        """
+        Parámetros:
+        - ser (SER): Modelo con el que se calculará la emoción.
+        - audio (str | np.ndarray): Ruta del archivo de audio o buffer float32 a 16 kHz.
+        """
+        self.ser = ser
+        self.audio = audio
+        self._futuro = None
+        self._descartada = False
+        self._lock = threading.Lock()
+
+    def lanzar(self, executor):
+        """Empieza a calcular la emoción en `executor` si todavía no se ha hecho."""
+        with self._lock:
+            if self._futuro is None:
+                self._futuro = executor.submit(self.ser.detect_emotion, self.audio)
+        return self
+
+    def resultado(self):
+        """Devuelve la emoción, calculándola en este hilo si no se había lanzado."""
+        with self._lock:
+            if self._futuro is None:
+                self._futuro = Future()
+                self._futuro.set_result(self.ser.detect_emotion(self.audio))
+        return self._futuro.result()
+
+    def descartar(self, motivo):
+        """
+        Libera el audio; si la emoción no llegó a calcularse (o estaba lanzada pero
+        aún en cola y se puede cancelar), la cuenta como evitada.
+        """
+        with self._lock:
+            if self._descartada:
+                return
+            if self._futuro is None or self._futuro.cancel():
+                self.ser.evitadas[motivo] += 1
+                self._futuro = Future()
+                self._futuro.set_result("unknown")
+            else:
+                self.ser.desperdiciadas[motivo] += 1
+            self._descartada = True
+            self.audio = None
@@ -9,6 +9,8 @@ Este módulo implementa la conversión de texto a voz utilizando:
 Funcionalidad:
 - `speak(text)`: Convierte texto en audio y lo reproduce en tiempo real.
 - `quack(times)`: Reproduce un sonido predefinido de "quack" un número determinado de veces.
+- `en_reproduccion()`: Indica si PATO está sonando (o acaba de sonar), para que la
+  captura continua no tome su propia voz como un comando.
 
 Dependencias:
 - `kokoro.KPipeline`: Para la síntesis de voz.
@@ -19,9 +21,13 @@ Dependencias:
 Clases y funciones:
 - `speak(text)`: Convierte y reproduce texto en voz.
 - `quack(times)`: Reproduce el sonido de un pato "quack".
+- `en_reproduccion()`: Indica si hay audio de PATO sonando por el altavoz.
 """
 
 import os
+import threading
+import time
+from contextlib import contextmanager
 from kokoro import KPipeline
 import soundfile as sf
 from playsound import playsound
@@ -37,6 +43,33 @@ EspeakWrapper.set_library(_ESPEAK_LIBRARY)
 # Inicialización del pipeline de Kokoro para TTS
 pipeline = KPipeline(lang_code='e')
 
+# Estado de reproducción: la captura continua descarta el audio grabado mientras suena PATO
+COLA_ECO = 0.3  # Segundos tras la reproducción en los que aún se considera eco (reverberación, buffers)
+_reproducciones = 0
+_fin_reproduccion = 0.0
+_reproduccion_lock = threading.Lock()
+
+
+@contextmanager
+def _reproduciendo():
+    """Marca el altavoz como ocupado mientras dura el bloque (admite reproducciones anidadas)."""
+    global _reproducciones, _fin_reproduccion
+    with _reproduccion_lock:
+        _reproducciones += 1
+    try:
+        yield
+    finally:
+        with _reproduccion_lock:
+            _reproducciones -= 1
+            _fin_reproduccion = time.monotonic()
+
+
+def en_reproduccion():
+    """Indica si PATO está reproduciendo audio o lo ha hecho hace menos de `COLA_ECO` segundos."""
+    with _reproduccion_lock:
+        return _reproducciones > 0 or time.monotonic() - _fin_reproduccion < COLA_ECO
+
+
 def speak(text):
     """
     Convierte el texto en audio y lo reproduce en tiempo real.
@@ -67,8 +100,9 @@ def speak(text):
     
         for i, (_, _, audio) in enumerate(generator):
             # Reproduce el audio generado
-            sd.play(audio, samplerate=25000)
-            sd.wait()
+            with _reproduciendo():
+                sd.play(audio, samplerate=25000)
+                sd.wait()
 
             # Guardar el fragmento en un archivo
             filename = os.path.join("Resources", "response.wav")
@@ -89,5 +123,6 @@ def quack(times):
         print(f"ERROR: No se encontró el archivo {quack_path}.")
         return
 
-    for _ in range(times):
-        playsound(quack_path)
+    with _reproduciendo():
+        for _ in range(times):
+            playsound(quack_path)
@@ -0,0 +1,161 @@
+"""
+TaskContext.py - Construcción del contexto de tareas para el prompt del LLM
+
+Este módulo selecciona qué tareas se envían al LLM en cada turno, en lugar de
+serializar todas las pendientes y completadas:
+- Puntúa las tareas por coincidencia con el nombre mencionado, cercanía de la
+  fecha de vencimiento (o la fecha que cita el usuario) y prioridad.
+- Las tareas completadas solo se incluyen si el usuario las menciona o pregunta
+  por ellas ("qué he completado", "tareas terminadas", "deshacer"), porque su
+  lista crece sin límite. Una orden como "completa el informe" no las pide.
+- Codifica las tareas en un JSON compacto (listas posicionales, sin sangría).
+- Respeta un presupuesto de tokens e indica cuántas tareas pendientes y
+  completadas existen sin mostrarse.
+
+Dependencias:
+- `TaskManager`: Fuente de las tareas pendientes y completadas.
+- `IntentClassifier.normalizar`: Normalización del texto para comparar palabras.
+- `Tokens.contar_tokens`: Estimación de tokens, la misma que usa el LLM.
+
+Clases:
+- `TaskContextBuilder`: Construye el contexto de tareas relevante para un mensaje.
+"""
+
+import json
+import re
+from datetime import datetime, timedelta
+from IntentClassifier import normalizar
+from Tokens import contar_tokens
+
+
+class TaskContextBuilder:
+    """
+    Selecciona y codifica las tareas relevantes para un mensaje del usuario.
+
+    `construir(mensaje)` devuelve el contexto en JSON compacto sin superar
+    `presupuesto_tokens` (estimados). Las tareas pendientes se ordenan por
+    relevancia y se añaden mientras quepan; las completadas solo si vienen al caso.
+    """
+
+    PALABRAS_VACIAS = {
+        "que", "los", "las", "del", "con", "para", "por", "una", "uno", "unos", "unas", "mis", "tus",
+        "tarea", "tareas", "pato", "oye", "quiero", "puedes", "dime", "tengo", "hay", "esta", "este",
+    }
+    PESO_PRIORIDAD = {"urgente": 3.0, "alta": 2.0, "normal": 0.5, "baja": 0.0}
+    # Preguntas por las tareas completadas o por deshacer una; no órdenes como "completa el informe"
+    PATRON_COMPLETADAS = re.compile(
+        r"\b(?:que|cuales|cuantas|cuantos)(?: \w+){0,2} (?:he|has|ha|hemos|habia) (?:(?:complet|termin|acab|finaliz)ado|hecho)\b"
+        r"|\b(?:complet|termin|acab|finaliz)adas\b|\bhechas\b|\b(?:deshac|deshaz|restaur)\w*"
+    )
+    FORMATO = {"pendientes": ["tarea", "vence", "prioridad"], "completadas": ["tarea", "completada"]}
+    TOKENS_OMITIDAS = 12  # Reserva para el recuento de "omitidas"
+
+    def __init__(self, task_manager, presupuesto_tokens=600, dias_ventana=7, max_completadas=10):
+        """
+        Parámetros:
+        - task_manager (TaskManager): Gestor del que se leen las tareas.
+        - presupuesto_tokens (int): Tokens estimados máximos del contexto.
+        - dias_ventana (int): Días hacia delante en los que una tarea se considera próxima.
+        - max_completadas (int): Tareas completadas máximas incluidas en un turno.
+        """
+        self.task_manager = task_manager
+        self.presupuesto_tokens = presupuesto_tokens
+        self.dias_ventana = dias_ventana
+        self.max_completadas = max_completadas
+        self.ultimo = {}  # Métricas del último contexto construido
+
+    def palabras(self, texto):
+        """Palabras significativas de un texto normalizado."""
+        return {p for p in normalizar(texto).split() if len(p) > 2 and p not in self.PALABRAS_VACIAS}
+
+    def fecha_mencionada(self, mensaje, hoy):
+        """Devuelve la fecha a la que se refiere el mensaje ("hoy", "mañana", YYYY-MM-DD...) o None."""
+        fecha = re.search(r"\b\d{4}-\d{2}-\d{2}\b", mensaje)
+        if fecha:
+            return fecha.group(0)
+        texto = normalizar(mensaje)
+        if "pasado manana" in texto:
+            return (hoy + timedelta(2)).strftime("%Y-%m-%d")
+        if re.search(r"\bmanana\b", texto):
+            return (hoy + timedelta(1)).strftime("%Y-%m-%d")
+        if re.search(r"\bhoy\b", texto):
+            return hoy.strftime("%Y-%m-%d")
+        return None
+
+    def puntuar(self, tarea, palabras_mensaje, fecha_mensaje, hoy):
+        """Puntuación de relevancia de una tarea para el mensaje actual."""
+        puntos = 10.0 * len(palabras_mensaje & self.palabras(tarea.get("task") or ""))
+
+        vence = tarea.get("due_date")
+        if vence:
+            if vence == fecha_mensaje:
+                puntos += 6.0
+            try:
+                dias = (datetime.strptime(vence, "%Y-%m-%d").date() - hoy.date()).days
+                if dias < 0:
+                    puntos += 4.0  # Vencida
+                elif dias <= self.dias_ventana:
+                    puntos += 3.0 * (1 - dias / (self.dias_ventana + 1))
+            except ValueError:
+                pass
+
+        return puntos + self.PESO_PRIORIDAD.get(tarea.get("priority"), 0.5)
+
+    def construir(self, mensaje):
+        """
+        Construye el contexto de tareas para un mensaje.
+
+        Retorna:
+        - (str): JSON compacto con "formato", "pendientes", "completadas" y, si
+          alguna tarea no se muestra (por no ser relevante o no caber en el
+          presupuesto), "omitidas" con el número de pendientes y completadas sin mostrar.
+        """
+        hoy = datetime.today()
+        palabras_mensaje = self.palabras(mensaje)
+        fecha_mensaje = self.fecha_mencionada(mensaje, hoy)
+        pide_completadas = bool(self.PATRON_COMPLETADAS.search(normalizar(mensaje)))
+
+        pendientes = sorted(
+            self.task_manager.tasks,
+            key=lambda t: (-self.puntuar(t, palabras_mensaje, fecha_mensaje, hoy), t.get("due_date") or "9999"),
+        )
+        completadas = [
+            t for t in sorted(self.task_manager.completed_tasks, key=lambda t: t.get("completed_at") or "", reverse=True)
+            if pide_completadas or palabras_mensaje & self.palabras(t.get("task") or "")
+        ][:self.max_completadas]
+
+        contexto = {"formato": self.FORMATO, "pendientes": [], "completadas": []}
+        candidatas_pendientes = [("pendientes", [t["task"], t.get("due_date"), t.get("priority")]) for t in pendientes]
+        candidatas_completadas = [("completadas", [t["task"], t.get("completed_at")]) for t in completadas]
+        # Si el usuario pregunta por las completadas, tienen preferencia sobre el resto de pendientes
+        candidatas = (candidatas_completadas + candidatas_pendientes if pide_completadas
+                      else candidatas_pendientes + candidatas_completadas)
+
+        tokens = contar_tokens(self.codificar(contexto)) + self.TOKENS_OMITIDAS
+        for lista, fila in candidatas:
+            coste = contar_tokens(json.dumps(fila, ensure_ascii=False)) + 1
+            if tokens + coste > self.presupuesto_tokens:
+                continue
+            contexto[lista].append(fila)
+            tokens += coste
+
+        # Todas las tareas sin mostrar, también las completadas descartadas por irrelevantes
+        omitidas = {
+            "pendientes": len(self.task_manager.tasks) - len(contexto["pendientes"]),
+            "completadas": len(self.task_manager.completed_tasks) - len(contexto["completadas"]),
+        }
+        if any(omitidas.values()):
+            contexto["omitidas"] = omitidas
+        texto = self.codificar(contexto)
+        self.ultimo = {
+            "tokens": contar_tokens(texto),
+            "pendientes": len(contexto["pendientes"]),
+            "completadas": len(contexto["completadas"]),
+            "omitidas": sum(omitidas.values()),
+        }
+        return texto
+
+    @staticmethod
+    def codificar(contexto):
+        """JSON sin espacios ni sangría, conservando tildes."""
+        return json.dumps(contexto, ensure_ascii=False, separators=(",", ":"))
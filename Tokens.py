@@ -0,0 +1,16 @@
+"""
+Tokens.py - Estimación del número de tokens de un texto
+
+Este módulo contiene la estimación de tokens compartida por los módulos que
+trabajan con presupuestos de prompt, sin depender del cliente del LLM:
+- `LLM`: recorte de la memoria conversacional y registro de tokens del prompt.
+- `TaskContext`: presupuesto del contexto de tareas.
+
+Funciones:
+- `contar_tokens()`: Estimación rápida de tokens de un texto.
+"""
+
+
+def contar_tokens(texto):
+    """Estimación rápida de tokens (unos 4 caracteres por token)."""
+    return len(texto) // 4 + 1
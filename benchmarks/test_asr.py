@@ -15,6 +15,7 @@ import jiwer
 import pandas as pd
 import ASR
 import re
+import time
 
 # 📌 Cargar las transcripciones del dataset TEDx Spanish
 transcription_file = "test_audios/transcriptions.csv"
@@ -50,38 +51,61 @@ def calcular_wer_cer(referencia, transcripcion):
     cer = jiwer.cer(referencia_norm, transcripcion_norm)
     return wer, cer
 
-def test_asr():
-    """Ejecuta pruebas de ASR en los audios del dataset TEDx Spanish."""
+def test_asr(batch_size=1, workers=1):
+    """
+    Ejecuta pruebas de ASR en los audios del dataset TEDx Spanish.
+
+    Por defecto (`batch_size=1`) se usa la decodificación secuencial, la misma
+    que PATO en directo, para que el WER sea comparable con ejecuciones
+    anteriores. Con `batch_size` > 1 se mide el pipeline por lotes, que aplica
+    VAD y omite las marcas de tiempo.
+    """
     global total_wer, total_cer, errores
 
     print("\n📌 INICIANDO TEST ASR con TEDx Spanish")
-    
-    numero = 1
-
-    for audio, referencia in test_audios.items():
-        audio_path = os.path.join("test_audios", os.path.basename(audio))  # 🔹 Asegurar que la ruta es correcta
-        print(f"\n🔍 {numero}/100 Probando ASR con: {audio_path}")
-        numero = numero +1
-        transcripcion = ASR.transcribe_audio_file(audio_path)  # Usar método de transcripción de PATO
-        
+    print(f"⚙️ batch_size={batch_size}, workers={workers}")
+
+    audio_paths = [os.path.join("test_audios", os.path.basename(audio)) for audio in test_audios]  # 🔹 Asegurar que la ruta es correcta
+    referencias = list(test_audios.values())
+    tiempo_total = 0
+    duracion_total = 0
+
+    inicio = time.perf_counter()
+    resultados = ASR.transcribe_audio_files(audio_paths, batch_size=batch_size, workers=workers)  # Usar transcripción en lote de PATO
+
+    for numero, (resultado, referencia) in enumerate(zip(resultados, referencias), start=1):
+        print(f"\n🔍 {numero}/{total_pruebas} Probando ASR con: {resultado['path']}")
+        transcripcion = resultado["texto"]
+
         if transcripcion:
             wer, cer = calcular_wer_cer(referencia, transcripcion)
             total_wer += wer
             total_cer += cer
+            tiempo_total += resultado["tiempo"]
+            duracion_total += resultado["duracion"]
 
             # 📌 Mostrar la transcripción esperada junto a la generada
             print(f"🔹 Original: {normalizar_texto(referencia)}")
             print(f"✅ Transcripción: {normalizar_texto(transcripcion)}")
             print(f"📊 WER: {wer:.2f}, CER: {cer:.2f}")
+            print(f"⏱️ Tiempo: {resultado['tiempo']:.3f} s | Audio: {resultado['duracion']:.2f} s | RTF: {resultado['rtf']:.3f}")
         else:
             print("❌ No se obtuvo transcripción")
             errores += 1
 
+    tiempo_pared = time.perf_counter() - inicio
+
     # Cálculo de métricas globales
     print("\n📊 RESULTADOS GLOBALES:")
     print(f"🔹 WER Promedio: {total_wer / total_pruebas:.2f}")
     print(f"🔹 CER Promedio: {total_cer / total_pruebas:.2f}")
     print(f"❌ Errores de transcripción: {errores}/{total_pruebas}")
+    if duracion_total:
+        print(f"⏱️ Tiempo de cómputo acumulado: {tiempo_total:.2f} s | RTF medio: {tiempo_total / duracion_total:.3f}")
+        print(f"⏱️ Tiempo total (reloj): {tiempo_pared:.2f} s | RTF efectivo: {tiempo_pared / duracion_total:.3f}")
 
 if __name__ == "__main__":
-    test_asr()
+    test_asr(
+        batch_size=int(sys.argv[1]) if len(sys.argv) > 1 else 1,
+        workers=int(sys.argv[2]) if len(sys.argv) > 2 else 1,
+    )
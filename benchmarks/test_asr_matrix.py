@@ -0,0 +1,147 @@
+import sys
+import os
+import json
+import time
+import itertools
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+from psutil import Process
+
+# Agregar el directorio padre al path para importar ASR.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from test_asr import test_audios, calcular_wer_cer
+
+# 📌 Matriz de perfiles de decodificación por defecto
+MODELOS = ["tiny", "base", "small"]
+COMPUTE_TYPES = ["int8", "int8_float32", "float32"]
+BEAM_SIZES = [1, 5]
+VAD_FILTER = [False, True]
+WITHOUT_TIMESTAMPS = [False, True]
+
+
+def rss_pico_mb():
+    """Devuelve el pico de memoria residente del proceso actual en MB."""
+    memoria = Process().memory_info()
+    if hasattr(memoria, "peak_wset"):  # Windows
+        return memoria.peak_wset / 2**20
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: KB
+
+
+def evaluar_configuracion(configuracion, audios):
+    """
+    Transcribe todos los audios con una configuración y calcula sus métricas.
+
+    Se ejecuta en un proceso nuevo para que el pico de memoria sea el de esta
+    configuración y no el de las anteriores.
+    """
+    import ASR
+
+    engine = ASR.ASREngine(model_size=configuracion["modelo"], compute_type=configuracion["compute_type"])
+    engine.cargar()
+
+    wers, cers, latencias = [], [], []
+    duracion_total = 0
+    errores = 0
+
+    for audio_path, referencia in audios:
+        try:
+            inicio = time.perf_counter()
+            segments, info = engine.model.transcribe(
+                audio_path, language="es",
+                beam_size=configuracion["beam_size"],
+                vad_filter=configuracion["vad_filter"],
+                without_timestamps=configuracion["without_timestamps"],
+            )
+            transcripcion = "".join(segment.text for segment in segments)
+            latencias.append(time.perf_counter() - inicio)
+            duracion_total += info.duration
+
+            wer, cer = calcular_wer_cer(referencia, transcripcion)
+            wers.append(wer)
+            cers.append(cer)
+        except Exception as e:
+            print(f"❌ ERROR con {audio_path}: {e}")
+            errores += 1
+
+    return {
+        **configuracion,
+        "wer": float(np.mean(wers)) if wers else None,
+        "cer": float(np.mean(cers)) if cers else None,
+        "latencia_media": float(np.mean(latencias)) if latencias else None,
+        "latencia_p95": float(np.percentile(latencias, 95)) if latencias else None,
+        "rtf": sum(latencias) / duracion_total if duracion_total else None,
+        "rss_pico_mb": rss_pico_mb(),
+        "errores": errores,
+    }
+
+
+def marcar_pareto(resultados):
+    """Marca las configuraciones que no están dominadas en WER y latencia media."""
+    for resultado in resultados:
+        resultado["pareto"] = resultado["wer"] is not None and not any(
+            otro is not resultado and otro["wer"] is not None
+            and otro["wer"] <= resultado["wer"] and otro["latencia_media"] <= resultado["latencia_media"]
+            and (otro["wer"] < resultado["wer"] or otro["latencia_media"] < resultado["latencia_media"])
+            for otro in resultados
+        )
+    return resultados
+
+
+def test_asr_matrix(modelos, compute_types, beam_sizes, vad_filter, without_timestamps, limite=None, salida="test_asr_matrix"):
+    """Recorre la matriz de perfiles de decodificación y guarda la tabla de Pareto en JSON y CSV."""
+    audios = [(os.path.join("test_audios", os.path.basename(audio)), referencia) for audio, referencia in test_audios.items()]
+    audios = audios[:limite] if limite else audios
+
+    configuraciones = [
+        {"modelo": m, "compute_type": c, "beam_size": b, "vad_filter": v, "without_timestamps": w}
+        for m, c, b, v, w in itertools.product(modelos, compute_types, beam_sizes, vad_filter, without_timestamps)
+    ]
+
+    print(f"\n📌 INICIANDO MATRIZ ASR: {len(configuraciones)} configuraciones x {len(audios)} audios")
+
+    resultados = []
+    contexto = multiprocessing.get_context("spawn")
+    for numero, configuracion in enumerate(configuraciones, start=1):
+        print(f"\n🔍 {numero}/{len(configuraciones)} {configuracion}")
+        with contexto.Pool(1) as pool:
+            resultado = pool.apply(evaluar_configuracion, (configuracion, audios))
+        resultados.append(resultado)
+        if resultado["wer"] is not None:
+            print(f"📊 WER: {resultado['wer']:.3f} | CER: {resultado['cer']:.3f} | "
+                  f"Latencia media: {resultado['latencia_media']:.3f} s | p95: {resultado['latencia_p95']:.3f} s | "
+                  f"RTF: {resultado['rtf']:.3f} | RSS pico: {resultado['rss_pico_mb']:.0f} MB")
+
+    marcar_pareto(resultados)
+    resultados.sort(key=lambda r: (not r["pareto"], r["latencia_media"] if r["latencia_media"] is not None else float("inf")))
+
+    # 📂 Guardar resultados
+    with open(f"{salida}.json", "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=4, ensure_ascii=False)
+    pd.DataFrame(resultados).to_csv(f"{salida}.csv", index=False, encoding="utf-8")
+
+    print("\n📊 FRENTE DE PARETO (WER vs latencia media):")
+    for resultado in resultados:
+        if resultado["pareto"]:
+            print(f"✅ {resultado['modelo']}/{resultado['compute_type']} beam={resultado['beam_size']} "
+                  f"vad={resultado['vad_filter']} sin_timestamps={resultado['without_timestamps']} -> "
+                  f"WER {resultado['wer']:.3f}, {resultado['latencia_media']:.3f} s, RTF {resultado['rtf']:.3f}")
+    print(f"\n📂 Resultados guardados en '{salida}.json' y '{salida}.csv'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Matriz de perfiles de decodificación del ASR")
+    parser.add_argument("--modelos", nargs="+", default=MODELOS)
+    parser.add_argument("--compute-types", nargs="+", default=COMPUTE_TYPES)
+    parser.add_argument("--beam-sizes", nargs="+", type=int, default=BEAM_SIZES)
+    parser.add_argument("--vad-filter", nargs="+", type=lambda v: v.lower() == "true", default=VAD_FILTER)
+    parser.add_argument("--without-timestamps", nargs="+", type=lambda v: v.lower() == "true", default=WITHOUT_TIMESTAMPS)
+    parser.add_argument("--limite", type=int, default=None, help="Número máximo de audios a evaluar")
+    parser.add_argument("--salida", default="test_asr_matrix", help="Prefijo de los archivos de resultados")
+    args = parser.parse_args()
+
+    test_asr_matrix(args.modelos, args.compute_types, args.beam_sizes, args.vad_filter,
+                    args.without_timestamps, args.limite, args.salida)
@@ -1,14 +1,17 @@
 import sys
 import os
+import time
+import numpy as np
 import pandas as pd
 from collections import defaultdict
 
 # Agregar el directorio padre al path para importar NLU.py
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from NLU import NLU
+from NLU import NLU, INTENTS_CONTROL
 
-nlu = NLU(models_path="D:\MASTER\PATO\models")
+MODELS_PATH = "D:\MASTER\PATO\models"
+NLU_PATH = os.path.join(os.path.dirname(__file__), "..", "rasa", "nlu.yml")
 
 test_intents = {
     "Adiós" : "despedir",
@@ -151,27 +154,40 @@ test_intents = {
     "¿Cuántas tareas he logrado completar hasta ahora?" : "nlu_fallback",
     "Recuérdame las tareas que ya marqué como hechas" : "nlu_fallback",
     "Quiero ver las tareas cerradas" : "nlu_fallback",
-    "Lista las últimas cinco tareas que completé" : "nlu_fallback"
+    "Lista las últimas cinco tareas que completé" : "nlu_fallback",
+
+    # Frases fuera de dominio que comparten palabras con los intents de control
+    "Sigue lloviendo" : "nlu_fallback",
+    "Completa el informe" : "nlu_fallback",
+    "Terminar presentación" : "nlu_fallback",
+    "Para mañana tengo que llamar al fontanero" : "nlu_fallback",
+    "Continúa la tarea de ordenar el garaje" : "nlu_fallback",
+    "Reinicia el router esta tarde" : "nlu_fallback"
 }
 
-# 📌 Variables para análisis de errores
-errores_por_intent = defaultdict(int)
-aciertos_por_intent = defaultdict(int)
-errores_detallados = []
-
-def test_nlu():
-    """Prueba la detección de intents con Rasa NLU y analiza los errores."""
-    print("\n📌 INICIANDO TEST DE NLU")
+def test_nlu(nlu, backend="rasa"):
+    """Prueba la detección de intents de un backend de NLU, analiza los errores y mide la latencia."""
+    print(f"\n📌 INICIANDO TEST DE NLU ({backend})")
     total_tests = len(test_intents)
     errores = 0
+    errores_por_intent = defaultdict(int)
+    aciertos_por_intent = defaultdict(int)
+    errores_detallados = []
+    latencias = []
+    falsos_positivos = 0  # Frases sin intent de control clasificadas como control
+    total_no_control = sum(intent not in INTENTS_CONTROL for intent in test_intents.values())
 
     for frase, intent_esperado in test_intents.items():
         print(f"\n🔍 Probando NLU con: \"{frase}\"")
 
+        inicio = time.perf_counter()
         intent_detectado = nlu.detectar_intent(frase)
+        latencias.append(time.perf_counter() - inicio)
 
         if intent_detectado is None:
             intent_detectado = "nlu_fallback"
+        if intent_esperado not in INTENTS_CONTROL and intent_detectado in INTENTS_CONTROL:
+            falsos_positivos += 1
 
         # 📌 Registro de aciertos y errores por intent
         if intent_detectado == intent_esperado:
@@ -183,10 +199,15 @@ def test_nlu():
             errores_detallados.append([frase, intent_esperado, intent_detectado])
             print(f"❌ ERROR: Se esperaba \"{intent_esperado}\", pero se detectó \"{intent_detectado}\"")
 
+    precision_total = (total_tests - errores) / total_tests * 100
+    tasa_falsos_positivos = falsos_positivos / total_no_control * 100 if total_no_control else 0
+
     # 📊 Resultados finales
-    print("\n📊 RESULTADOS GLOBALES:")
-    print(f"🔹 Precisión total: {((total_tests - errores) / total_tests) * 100:.2f}%")
+    print(f"\n📊 RESULTADOS GLOBALES ({backend}):")
+    print(f"🔹 Precisión total: {precision_total:.2f}%")
     print(f"❌ Total de errores: {errores} / {total_tests}")
+    print(f"⚠️ Falsos positivos de control: {falsos_positivos} / {total_no_control} frases sin control ({tasa_falsos_positivos:.2f}%)")
+    print(f"⏱️ Latencia media: {np.mean(latencias) * 1000:.2f} ms | p95: {np.percentile(latencias, 95) * 1000:.2f} ms")
 
     # 📊 Análisis de errores por intent
     print("\n📊 ERRORES POR INTENT:")
@@ -196,9 +217,39 @@ def test_nlu():
         print(f"❌ {intent}: {count} errores | Precisión: {precision:.2f}%")
 
     # 📂 Guardar reporte de errores en CSV
+    archivo = "test_nlu_errores.csv" if backend == "rasa" else f"test_nlu_errores_{backend}.csv"
     df_errores = pd.DataFrame(errores_detallados, columns=["Frase", "Intent esperado", "Intent detectado"])
-    df_errores.to_csv("test_nlu_errores.csv", index=False, encoding="utf-8")
-    print("\n📂 Reporte de errores guardado en 'test_nlu_errores.csv'")
+    df_errores.to_csv(archivo, index=False, encoding="utf-8")
+    print(f"\n📂 Reporte de errores guardado en '{archivo}'")
+
+    return {
+        "backend": backend,
+        "precision": precision_total,
+        "errores": errores,
+        "falsos_positivos": tasa_falsos_positivos,
+        "latencia_media_ms": np.mean(latencias) * 1000,
+        "latencia_p95_ms": np.percentile(latencias, 95) * 1000,
+    }
 
 if __name__ == "__main__":
-    test_nlu()
\ No newline at end of file
+    # Uso: python test_nlu.py [rasa] [local]  (por defecto compara ambos backends)
+    backends = sys.argv[1:] or ["rasa", "local"]
+    resumen = []
+
+    for backend in backends:
+        inicio = time.perf_counter()
+        try:
+            nlu = NLU(models_path=MODELS_PATH, backend=backend, nlu_path=NLU_PATH)
+        except Exception as e:
+            print(f"❌ No se pudo iniciar el backend {backend}: {e}")
+            continue
+        tiempo_arranque = time.perf_counter() - inicio
+        resultado = test_nlu(nlu, backend)
+        resultado["arranque_s"] = tiempo_arranque
+        resumen.append(resultado)
+        nlu.stop_rasa_nlu()
+
+    print("\n📊 COMPARATIVA DE BACKENDS:")
+    for r in resumen:
+        print(f"🔹 {r['backend']}: precisión {r['precision']:.2f}% | falsos positivos de control {r['falsos_positivos']:.2f}% | latencia media {r['latencia_media_ms']:.2f} ms | "
+              f"p95 {r['latencia_p95_ms']:.2f} ms | arranque {r['arranque_s']:.2f} s")
@@ -0,0 +1,100 @@
+import sys
+import os
+import glob
+import json
+import time
+import argparse
+import numpy as np
+
+# Agregar el directorio padre al path para importar SER.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from SER import SER
+
+
+def medir_backend(backend, audios, batch_size):
+    """Carga un backend de SER y devuelve sus resultados por audio y el tiempo de carga."""
+    inicio = time.perf_counter()
+    ser = SER(backend=backend)
+    tiempo_carga = time.perf_counter() - inicio
+
+    ser.detect_emotions(audios[:1], batch_size=1)  # Calentamiento
+    resultados = ser.detect_emotions(audios, batch_size=batch_size)
+    return resultados, tiempo_carga
+
+
+def resumen_latencia(resultados):
+    """Latencia media y p95 por audio de los resultados válidos."""
+    tiempos = [r["tiempo"] for r in resultados if r["scores"] is not None]
+    if not tiempos:
+        return None, None
+    return float(np.mean(tiempos)), float(np.percentile(tiempos, 95))
+
+
+def test_ser_backends(referencia="funasr", candidato="int8", batch_size=1, limite=None, salida="test_ser_backends.json"):
+    """Compara las puntuaciones y la latencia de dos backends de SER sobre `test_audios`."""
+    audios = sorted(glob.glob(os.path.join("test_audios", "*.wav")))
+    audios = audios[:limite] if limite else audios
+    if not audios:
+        raise FileNotFoundError("⚠ No se encontraron audios en `test_audios`.")
+
+    print(f"\n📌 COMPARANDO SER: {referencia} vs {candidato} en {len(audios)} audios (batch_size={batch_size})")
+
+    resultados_ref, carga_ref = medir_backend(referencia, audios, batch_size)
+    resultados_cand, carga_cand = medir_backend(candidato, audios, batch_size)
+
+    coincidencias, diferencias, detalle = 0, [], []
+    for audio, ref, cand in zip(audios, resultados_ref, resultados_cand):
+        if ref["scores"] is None or cand["scores"] is None:
+            print(f"❌ ERROR con {audio}: {ref['error'] or cand['error']}")
+            continue
+        diferencia = float(np.max(np.abs(np.array(ref["scores"]) - np.array(cand["scores"]))))
+        diferencias.append(diferencia)
+        coincidencias += ref["emocion"] == cand["emocion"]
+        detalle.append({
+            "audio": audio,
+            referencia: ref["emocion"],
+            candidato: cand["emocion"],
+            "max_diferencia_scores": diferencia,
+            f"tiempo_{referencia}": ref["tiempo"],
+            f"tiempo_{candidato}": cand["tiempo"],
+        })
+
+    media_ref, p95_ref = resumen_latencia(resultados_ref)
+    media_cand, p95_cand = resumen_latencia(resultados_cand)
+    resumen = {
+        "audios": len(detalle),
+        "coincidencia_etiquetas": coincidencias / len(detalle) if detalle else None,
+        "max_diferencia_scores": max(diferencias) if diferencias else None,
+        "media_diferencia_scores": float(np.mean(diferencias)) if diferencias else None,
+        referencia: {"carga": carga_ref, "latencia_media": media_ref, "latencia_p95": p95_ref},
+        candidato: {"carga": carga_cand, "latencia_media": media_cand, "latencia_p95": p95_cand},
+    }
+
+    print("\n📊 RESULTADOS:")
+    if detalle:
+        print(f"✅ Coincidencia de etiquetas: {resumen['coincidencia_etiquetas']:.2%}")
+        print(f"📏 Diferencia de puntuaciones: media {resumen['media_diferencia_scores']:.4f} | máx {resumen['max_diferencia_scores']:.4f}")
+    for backend in (referencia, candidato):
+        datos = resumen[backend]
+        if datos["latencia_media"] is not None:
+            print(f"⏱️ {backend}: carga {datos['carga']:.2f} s | latencia media {datos['latencia_media']:.3f} s | p95 {datos['latencia_p95']:.3f} s")
+    if media_ref and media_cand:
+        print(f"🚀 Aceleración de {candidato} sobre {referencia}: x{media_ref / media_cand:.2f}")
+
+    # 📂 Guardar resultados
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump({"resumen": resumen, "detalle": detalle}, f, indent=4, ensure_ascii=False)
+    print(f"\n📂 Resultados guardados en '{salida}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paridad y latencia entre backends de SER")
+    parser.add_argument("--referencia", default="funasr", choices=SER.BACKENDS)
+    parser.add_argument("--candidato", default="int8", choices=SER.BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--limite", type=int, default=None, help="Número máximo de audios a evaluar")
+    parser.add_argument("--salida", default="test_ser_backends.json")
+    args = parser.parse_args()
+
+    test_ser_backends(args.referencia, args.candidato, args.batch_size, args.limite, args.salida)
@@ -12,14 +12,30 @@ Clases:
 Dependencias:
 - ASR: Módulo de reconocimiento de voz.
 - TTS: Módulo de síntesis de voz.
+- AudioCapture: Captura continua del micrófono con buffer circular.
 - DialogManager: Gestiona los diálogos y la lógica de respuesta del asistente.
 
+Con `--streaming` el ASR emite transcripciones parciales mientras el usuario
+habla y el gestor de diálogo preclasifica el intent antes del fin de la frase.
+
+Con `--continuo` el micrófono se captura sin pausa en un hilo dedicado
+(`AudioCapture`) y las frases se encolan, de modo que no se pierde lo que el
+usuario dice mientras PATO procesa o habla.
+
+Con `--nlu-local` los intents se detectan con el clasificador en proceso
+entrenado desde `rasa/nlu.yml`, sin arrancar el servidor Rasa.
+
+Con `--llm-streaming` la respuesta del LLM se sintetiza frase a frase mientras
+se genera, en lugar de esperar al JSON completo.
+
 El asistente se ejecuta en un bucle continuo hasta que se recibe una señal de apagado.
 """
 
+import sys
 import ASR
 import TTS
 import time  
+from AudioCapture import CapturaContinua
 from DialogManager import DialogManager 
 
 class AsistenteVirtual:
@@ -32,16 +48,25 @@ class AsistenteVirtual:
     - shutdown: Apaga el asistente liberando recursos correctamente.
     """
 
-    def __init__(self):
+    def __init__(self, streaming=False, continuo=False, nlu_backend="rasa", llm_streaming=False):
         """Inicializa el asistente virtual y su gestor de diálogo."""
         print("Inicializando PATO...")
         self.should_run = True
+        self.nlu_backend = nlu_backend  # "rasa" o "local"
+        self.llm_streaming = llm_streaming  # Hablar mientras el LLM genera
+        self.streaming = streaming  # Usar transcripciones parciales del ASR
+        self.captura = CapturaContinua() if continuo else None  # Captura continua del micrófono
         self.dialog_manager = None  
         
         try:
+            ASR.model_tiers.cargar()  # Cargar y calentar los modelos de reposo y activo
+            if self.captura:
+                self.captura.iniciar()  # La captura continua alimenta también el estimador de ruido
+            else:
+                ASR.iniciar_seguimiento_ruido(TTS.en_reproduccion)  # Umbral siempre actualizado, sin el eco del TTS
             self.dialog_manager = DialogManager(self) 
         except Exception as e:
-            print(f"Error al inicializar DialogManager: {e}")
+            print(f"Error al inicializar los módulos de PATO: {e}")
             self.should_run = False  # Evita la ejecución si falla la inicialización.
 
     def run(self):
@@ -50,13 +75,34 @@ class AsistenteVirtual:
         TTS.quack(2)  # Señal sonora para indicar que está listo.
 
         while self.should_run:
-            command, command_wav_file = ASR.listen_for_command()
+            solo_activacion = self.solo_activacion()
+            if self.captura:
+                frase = self.captura.siguiente_frase(timeout=0.5)
+                command, command_audio, info = ASR.transcribir_frase(frase, solo_activacion=solo_activacion)
+            elif self.streaming:
+                command, command_audio, info = self.escuchar_en_streaming(solo_activacion)
+            else:
+                command, command_audio, info = ASR.listen_for_command(solo_activacion=solo_activacion)
             
-            if command and self.dialog_manager:
-                self.dialog_manager.procesar_comando(command, command_wav_file)
+            # Las frases de baja confianza (ruido, alucinaciones) no llegan al diálogo
+            if command and self.dialog_manager and ASR.confidence_gate.aceptar(command, info):
+                self.dialog_manager.procesar_comando(command, command_audio)
             
             time.sleep(0.1)  # Pequeña pausa para evitar uso excesivo de CPU.
 
+    def solo_activacion(self):
+        """Indica si solo interesa detectar la frase de activación (conversación inactiva)."""
+        return self.dialog_manager is not None and not self.dialog_manager.conversacion_activa
+
+    def escuchar_en_streaming(self, solo_activacion=False):
+        """Consume las hipótesis del ASR en streaming y devuelve la frase final, su audio e info."""
+        for hipotesis in ASR.escuchar_en_streaming(solo_activacion=solo_activacion):
+            if hipotesis["final"]:
+                return hipotesis["texto"], hipotesis["audio"], hipotesis["info"]
+            if self.dialog_manager and ASR.confidence_gate.motivo_rechazo(hipotesis["texto"], hipotesis["info"]) is None:
+                self.dialog_manager.procesar_parcial(hipotesis["texto"])
+        return None, None, None
+
     def shutdown(self):
         """Apaga el asistente liberando los recursos utilizados."""
         try:
@@ -64,13 +110,17 @@ class AsistenteVirtual:
                 self.dialog_manager.shutdown()
         except Exception as e:
             print(f"Error al cerrar DialogManager: {e}")
+        if self.captura:
+            self.captura.detener()
         self.should_run = False
 
 if __name__ == "__main__":
     asistente = None  
 
     try:
-        asistente = AsistenteVirtual()
+        asistente = AsistenteVirtual(streaming="--streaming" in sys.argv, continuo="--continuo" in sys.argv,
+                                     nlu_backend="local" if "--nlu-local" in sys.argv else "rasa",
+                                     llm_streaming="--llm-streaming" in sys.argv)
         if asistente.should_run:  # Solo ejecuta si la inicialización fue exitosa.
             asistente.run()
     except KeyboardInterrupt:  # Captura Ctrl+C para apagado manual.